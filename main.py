@@ -1,48 +1,112 @@
 # Requirements (requirements.txt)
-# python-telegram-bot==21.6
+# python-telegram-bot[rate-limiter]==21.6
 # asyncpg==0.29.0
-# httpx==0.27.2
+# httpx[http2]==0.27.2
+# aiolimiter==1.1.0
+# uvloop==0.19.0  # optional, non-Windows
 # python-dotenv==1.0.1  # optional
 
-import os, logging, threading, asyncio, re
-from dataclasses import dataclass, field
-from typing import List, Optional, Dict, Tuple
+import os, logging, asyncio, re, struct, json, atexit, time, socket
+from contextlib import asynccontextmanager
+from copy import deepcopy
+from functools import partial, wraps
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from collections import Counter, OrderedDict
+from enum import IntEnum
+from dataclasses import dataclass, field, asdict
+from typing import List, Optional, Dict, Tuple, Callable, Awaitable, Any
 import asyncpg
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from aiolimiter import AsyncLimiter
 
 from telegram import (
     Update, InlineKeyboardMarkup, InlineKeyboardButton,
-    MessageEntity
+    MessageEntity, LinkPreviewOptions, InputMediaPhoto, InputMediaVideo
 )
 from telegram.constants import ParseMode
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler,
-    ContextTypes, filters, TypeHandler
+    ContextTypes, filters, TypeHandler, AIORateLimiter, PicklePersistence, PersistenceInput
 )
 from telegram.request import HTTPXRequest
-from telegram.error import TelegramError
+from telegram.error import TelegramError, RetryAfter, Forbidden, BadRequest, NetworkError
 
 # ---------- Command sanitation for /setting content ----------
 _CMD_EDGE = re.compile(r"^\s*/(?:start|setting)(?:@[A-Za-z0-9_]+)?\s*", re.IGNORECASE)
 _CMD_EDGE_TAIL = re.compile(r"\s*/(?:start|setting)(?:@[A-Za-z0-9_]+)?\s*$", re.IGNORECASE)
+_WS = re.compile(r"[ \t]+")
+# URL tombol/link: http(s) tanpa spasi (Telegram menolak URL berspasi dengan BUTTON_URL_INVALID)
+_URL_RE = re.compile(r"https?://\S+", re.IGNORECASE)  # \S Unicode: NBSP dkk. juga ditolak
+
+def _valid_url(text:Optional[str]) -> bool:
+    return bool(text) and _URL_RE.fullmatch(text.strip()) is not None
 
 def sanitize_welcome(text: str) -> str:
     if not text:
         return ""
+    # tanpa "/" tidak mungkin ada /start atau /setting -> lewati regex command
+    if "/" not in text:
+        return _WS.sub(" ", text).strip()
     txt = _CMD_EDGE.sub("", text)
     txt = _CMD_EDGE_TAIL.sub("", txt)
-    txt = re.sub(r"[ \t]+", " ", txt).strip()
+    txt = _WS.sub(" ", txt).strip()
     return txt
 
 # ---------------- Logging ----------------
-logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s | %(message)s")
+# Event loop hanya memasukkan record ke antrean; penulisan ke stderr dilakukan thread QueueListener.
+_log_queue: SimpleQueue = SimpleQueue()
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s | %(message)s"))
+_log_listener = QueueListener(_log_queue, _log_stream)
+_log_enqueue = QueueHandler(_log_queue)
+_log_enqueue.setFormatter(logging.Formatter("%(message)s"))  # format lengkap dilakukan _log_stream
+logging.basicConfig(level=logging.INFO, handlers=[_log_enqueue])
+_log_listener.start()
+atexit.register(_log_listener.stop)
 log = logging.getLogger("nagabola-bot")
 
 # ---------------- Env ----------------
 BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 ENV_OWNER_ID = int(os.getenv("OWNER_ID", "0") or "0")
 DATABASE_URL = os.getenv("DATABASE_URL", "")
+# PgBouncer (pool_mode=transaction) di depan Postgres: prepared statement tidak bertahan antar
+# transaksi dan LISTEN tidak bisa dipakai -> matikan statement cache; LISTEN lewat DATABASE_DIRECT_URL.
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER") == "1"
+DATABASE_DIRECT_URL = os.getenv("DATABASE_DIRECT_URL", "" if DB_PGBOUNCER else DATABASE_URL)
 PORT = int(os.getenv("PORT", "8080"))
+# default pool: (core * 2) + 1 koneksi maks, separuh core tetap hangat; bisa dioverride lewat env.
+# Core yang benar-benar boleh dipakai proses (container), bukan core host; dibatasi supaya
+# beberapa instance tidak menghabiskan max_connections Postgres/PgBouncer.
+_CPU = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 2)
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", str(min(max(2, _CPU // 2), 4))))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", str(min(_CPU * 2 + 1, 10))))
+ACTIVE_DAYS = int(os.getenv("ACTIVE_DAYS", "90"))  # batas "aktif" untuk /broadcast_active
+LOG_UPDATES = os.getenv("LOG_UPDATES") == "1"      # pasang debug_all (log tiap update, level DEBUG)
+if LOG_UPDATES:
+    log.setLevel(logging.DEBUG)  # hanya logger bot; httpx/telegram tetap di INFO
+BROADCAST_CONCURRENCY = 20  # request broadcast yang boleh berjalan bersamaan
+BROADCAST_RATE = 24         # pesan/detik; sisa kuota global disisakan untuk balasan interaktif
+BROADCAST_ATTEMPTS = 3      # percobaan per user untuk error jaringan/timeout
+BROADCAST_QUEUE_SIZE = 2000 # user_id yang boleh menunggu di antrean broadcast
+BROADCAST_CHUNK = 1000      # user per checkpoint progres broadcast_jobs
+MIN_USER_ID = -(2 ** 63)    # offset awal keyset (BIGINT minimum)
+TRACK_BATCH = 500           # maks user per flush track_writer
+TRACK_FLUSH_INTERVAL = 0.25 # detik menunggu update lain sebelum flush track
+SESSION_TTL = 3600          # detik; session IDLE yang tidak disentuh selama ini dibuang
+SESSION_STALE_TTL = 86400   # detik; flow admin yang ditinggal di tengah jalan ikut dibuang
+SESSION_GC_INTERVAL = 300   # detik antar sapuan session
+SESSION_FLUSH_INTERVAL = 10 # detik antar penulisan file session (hanya bila ada perubahan)
+CONCURRENT_UPDATES = 64     # update yang diproses bersamaan (antar user); per user tetap berurutan
+USER_LOCKS_MAX = 1024       # maks lock per user yang disimpan (LRU)
+USER_QUEUE_DEPTH = 3        # maks update per user yang boleh antre sebelum ditolak
+ALBUM_MAX = 10              # batas item sendMediaGroup
+ALBUM_WAIT = 1.5            # detik tanpa item baru sebelum album dianggap lengkap
+SESSIONS_FILE = os.getenv("SESSIONS_FILE", "sessions.pkl")  # PicklePersistence untuk user_data (session)
+LOG_SAMPLE = 200            # log gagal/blokir broadcast tiap N kejadian per jenis
+BROADCAST_CLAIM_TTL = 300  # detik tanpa checkpoint sebelum job milik instance lain dianggap mati
+BROADCAST_RESUME_INTERVAL = 60  # detik antar pencarian job broadcast yang terlantar
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{os.urandom(3).hex()}"  # pemilik job broadcast
+CACHED_TABLES = ("admins", "settings", "promo_links")  # tabel yang di-cache di bot_data (trigger NOTIFY)
 
 if not BOT_TOKEN:
     raise RuntimeError("BOT_TOKEN kosong")
@@ -62,6 +126,8 @@ async def init_db(pool):
                 last_seen TIMESTAMPTZ NOT NULL
             )"""
         )
+        # dipakai /broadcast_active (filter & urutan by last_seen)
+        await con.execute("CREATE INDEX IF NOT EXISTS users_last_seen_idx ON users(last_seen)")
         await con.execute(
             """CREATE TABLE IF NOT EXISTS admins(
                 user_id BIGINT PRIMARY KEY
@@ -161,17 +227,68 @@ async def init_db(pool):
                     ("Lihat Link", "https://example.com/link", 1),
                 ]
             )
+        # Progres broadcast (supaya bisa dilanjutkan setelah crash/redeploy)
+        await con.execute(
+            """CREATE TABLE IF NOT EXISTS broadcast_jobs(
+                id SERIAL PRIMARY KEY,
+                draft JSONB NOT NULL,
+                report_chat_id BIGINT NOT NULL,
+                next_offset BIGINT NOT NULL,
+                total INT NOT NULL DEFAULT 0,
+                sent INT NOT NULL DEFAULT 0,
+                blocked INT NOT NULL DEFAULT 0,
+                deleted INT NOT NULL DEFAULT 0,
+                failed INT NOT NULL DEFAULT 0,
+                done BOOLEAN NOT NULL DEFAULT FALSE,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )"""
+        )
+        # klaim job: hanya satu instance yang menjalankan job, diperbarui tiap checkpoint
+        await con.execute(
+            """ALTER TABLE broadcast_jobs
+                 ADD COLUMN IF NOT EXISTS owner TEXT,
+                 ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMPTZ"""
+        )
+        # Invalidation cache in-memory antar instance: NOTIFY cache_changed dengan payload nama tabel
+        await con.execute(
+            """CREATE OR REPLACE FUNCTION notify_cache_changed() RETURNS trigger AS $$
+               BEGIN
+                 PERFORM pg_notify('cache_changed', TG_TABLE_NAME);
+                 RETURN NULL;
+               END $$ LANGUAGE plpgsql"""
+        )
+        # trigger hanya dibuat bila belum ada: tanpa DROP/CREATE (lock eksklusif) di setiap start,
+        # dan instance yang start bersamaan cukup kalah dengan DuplicateObjectError
+        for table in CACHED_TABLES:
+            exists = await con.fetchval(
+                "SELECT 1 FROM pg_trigger WHERE tgrelid=$1::regclass AND tgname=$2",
+                table, f"{table}_cache_changed"
+            )
+            if exists:
+                continue
+            try:
+                await con.execute(
+                    f"""CREATE TRIGGER {table}_cache_changed
+                        AFTER INSERT OR UPDATE OR DELETE ON {table}
+                        FOR EACH STATEMENT EXECUTE PROCEDURE notify_cache_changed()"""
+                )
+            except asyncpg.DuplicateObjectError:
+                pass
 
-async def upsert_user(pool, uid, first_name, username):
+async def upsert_users(pool, rows:List[Tuple[int, Optional[str], Optional[str]]]):
+    # Satu statement set-based dari array kolom (UNNEST): satu round-trip per flush, tanpa
+    # temp table/transaksi (aman di balik PgBouncer); rows harus unik per user_id (track_writer sudah dedup).
+    ids, first_names, usernames = zip(*rows)
     async with pool.acquire() as con:
         await con.execute(
             """INSERT INTO users(user_id, first_name, username, last_seen)
-               VALUES($1,$2,$3,NOW())
+               SELECT u.user_id, u.first_name, u.username, NOW()
+               FROM UNNEST($1::bigint[], $2::text[], $3::text[]) AS u(user_id, first_name, username)
                ON CONFLICT (user_id) DO UPDATE SET
                  first_name=EXCLUDED.first_name,
                  username=EXCLUDED.username,
                  last_seen=NOW()""",
-            uid, first_name, username,
+            ids, first_names, usernames
         )
 
 async def get_owner_id(pool) -> int:
@@ -190,13 +307,6 @@ async def set_owner_id(pool, new_owner_id:int):
             str(new_owner_id)
         )
 
-async def is_admin(pool, uid:int) -> bool:
-    owner_id = await get_owner_id(pool)
-    if uid == owner_id:
-        return True
-    async with pool.acquire() as con:
-        return await con.fetchval("SELECT 1 FROM admins WHERE user_id=$1", uid) is not None
-
 async def add_admin(pool, uid:int) -> bool:
     try:
         owner_id = await get_owner_id(pool)
@@ -217,31 +327,207 @@ async def del_admin(pool, uid:int) -> bool:
         res = await con.execute("DELETE FROM admins WHERE user_id=$1", uid)
         return res.endswith("1")
 
-async def get_admins(pool) -> List[int]:
-    owner_id = await get_owner_id(pool)
+async def get_owner_and_admins(pool) -> Tuple[int, List[int]]:
+    # owner + daftar admin dalam satu round-trip
     async with pool.acquire() as con:
-        rows = await con.fetch("SELECT user_id FROM admins ORDER BY user_id")
-        ids = [r[0] for r in rows]
+        row = await con.fetchrow(
+            "SELECT (SELECT value FROM settings WHERE key='owner_id') AS owner, "
+            "ARRAY(SELECT user_id FROM admins ORDER BY user_id) AS admins"
+        )
+    try:
+        owner_id = int(row["owner"])
+    except:
+        owner_id = ENV_OWNER_ID
+    ids = list(row["admins"])
     if owner_id not in ids:
         ids.insert(0, owner_id)
-    return ids
+    return owner_id, ids
+
+# ---- Admin set & owner (in-memory; DB tetap sumber kebenaran)
+# Filter command admin: non-admin ditolak PTB sebelum masuk handler (lihat build_app).
+# Isinya diperbarui setiap refresh_admins, jadi handler tidak perlu didaftarkan ulang.
+ADMIN_FILTER = filters.User(allow_empty=False)
+
+async def refresh_admins(bot_data:dict, pool) -> None:
+    # diganti utuh (bukan dimutasi) supaya pembaca tidak pernah melihat set setengah jadi
+    owner_id, ids = await get_owner_and_admins(pool)
+    bot_data["owner_id"] = owner_id
+    bot_data["admins"] = frozenset(ids)
+    ADMIN_FILTER.user_ids = ids
+
+def owner_id_sync(bot_data:dict) -> int:
+    return bot_data.get("owner_id", ENV_OWNER_ID)
+
+# ---- Invalidation cache lewat LISTEN/NOTIFY (perubahan dari instance lain / psql)
+# nama tabel (payload NOTIFY) -> fungsi refresh cache bot_data
+CACHE_REFRESHERS: Dict[str, Tuple[Callable[[dict, asyncpg.Pool], Awaitable[None]], ...]] = {}
+
+async def _refresh_cache(bot_data:dict, pool, table:str) -> None:
+    for fn in CACHE_REFRESHERS.get(table, ()):
+        try:
+            await fn(bot_data, pool)
+        except Exception as e:
+            log.warning("Cache refresh %s for %s failed: %s", fn.__name__, table, e)
+
+async def start_cache_listener(bot_data:dict, pool) -> Optional[asyncpg.Connection]:
+    # koneksi khusus di luar pool: LISTEN terikat ke satu sesi (harus langsung ke Postgres)
+    if not DATABASE_DIRECT_URL:
+        log.warning("DB_PGBOUNCER=1 tanpa DATABASE_DIRECT_URL: cache tidak disinkron antar instance")
+        return None
+    pending: set = set()
+
+    def _spawn(coro) -> None:
+        t = asyncio.create_task(coro)
+        pending.add(t)
+        t.add_done_callback(pending.discard)
+
+    def _on_notify(_con, _pid, _channel, payload):
+        _spawn(_refresh_cache(bot_data, pool, payload))
+
+    def _on_terminate(con):
+        # koneksi putus (restart Postgres, idle timeout, dll.); close() saat shutdown tidak
+        # dihitung karena post_shutdown sudah mengeluarkannya dari bot_data lebih dulu
+        if bot_data.get("cache_listener") is con:
+            log.warning("Cache listener connection lost, reconnecting")
+            _spawn(_reconnect())
+
+    async def _connect() -> asyncpg.Connection:
+        con = await asyncpg.connect(DATABASE_DIRECT_URL)
+        con.add_termination_listener(_on_terminate)
+        await con.add_listener("cache_changed", _on_notify)
+        bot_data["cache_listener"] = con
+        return con
+
+    async def _reconnect():
+        delay = 1
+        while True:
+            try:
+                await _connect()
+                break
+            except Exception as e:  # termasuk InterfaceError saat failover: tetap coba lagi
+                log.warning("Cache listener reconnect failed: %r (retry in %ss)", e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+        # NOTIFY selama putus hilang: muat ulang semua cache
+        for table in CACHED_TABLES:
+            await _refresh_cache(bot_data, pool, table)
+
+    return await _connect()
+
+def is_admin_sync(bot_data:dict, uid:int) -> bool:
+    return uid in bot_data.get("admins", frozenset())
 
 async def count_users(pool) -> int:
     async with pool.acquire() as con:
         return int(await con.fetchval("SELECT COUNT(*) FROM users"))
 
-async def get_all_user_ids(pool) -> List[int]:
+# COPY ... (FORMAT binary): header 19 byte (signature 11 + flags 4 + panjang ekstensi 4),
+# lalu per baris int16 jumlah kolom, int32 panjang, int8 user_id; diakhiri int16 -1.
+_PGCOPY_HEADER = 19
+_PGCOPY_ROW = struct.Struct("!hiq")
+_PGCOPY_TRAILER = b"\xff\xff"
+
+async def stream_user_ids(pool, sink:Callable[[int], Awaitable[None]], active_only:bool=False,
+                          after:int=MIN_USER_ID, limit:int=BROADCAST_CHUNK) -> int:
+    # Stream maks `limit` user_id > `after` (urut user_id) lewat COPY biner: tanpa Record per
+    # baris dan memori O(chunk). sink di-await per id (backpressure ke COPY).
+    buf = bytearray()
+    header_done = False
+    count = 0
+
+    async def _on_chunk(chunk:bytes):
+        nonlocal header_done, count
+        buf.extend(chunk)
+        off = 0
+        if not header_done:
+            if len(buf) < _PGCOPY_HEADER:
+                return
+            off = _PGCOPY_HEADER + int.from_bytes(buf[15:19], "big")
+            if len(buf) < off:
+                return
+            header_done = True
+        end = len(buf)
+        while end - off >= 2:
+            if buf[off:off + 2] == _PGCOPY_TRAILER:
+                off = end
+                break
+            if end - off < _PGCOPY_ROW.size:
+                break
+            _, _, uid = _PGCOPY_ROW.unpack_from(buf, off)
+            off += _PGCOPY_ROW.size
+            await sink(uid)
+            count += 1
+        del buf[:off]
+
     async with pool.acquire() as con:
-        rows = await con.fetch("SELECT user_id FROM users")
-        return [r[0] for r in rows]
+        if active_only:
+            await con.copy_from_query(
+                "SELECT user_id FROM users WHERE user_id > $1 "
+                "AND last_seen > NOW() - make_interval(days => $3) ORDER BY user_id LIMIT $2",
+                after, limit, ACTIVE_DAYS, output=_on_chunk, format="binary"
+            )
+        else:
+            await con.copy_from_query(
+                "SELECT user_id FROM users WHERE user_id > $1 ORDER BY user_id LIMIT $2",
+                after, limit, output=_on_chunk, format="binary"
+            )
+    return count
 
-async def _delete_user(pool, uid:int) -> None:
+async def _delete_users(pool, uids:List[int]) -> None:
     try:
         async with pool.acquire() as con:
-            await con.execute("DELETE FROM users WHERE user_id=$1", uid)
+            await con.execute("DELETE FROM users WHERE user_id = ANY($1::bigint[])", uids)
     except Exception as e:
-        log.warning("delete user %s failed: %s", uid, e)
+        log.warning("delete %d users failed: %s", len(uids), e)
+
+
+# ---- Broadcast jobs
+async def create_broadcast_job(pool, draft_json:str, report_chat_id:int) -> int:
+    async with pool.acquire() as con:
+        return await con.fetchval(
+            """INSERT INTO broadcast_jobs(draft, report_chat_id, next_offset, owner, claimed_at)
+               VALUES($1,$2,$3,$4,NOW()) RETURNING id""",
+            draft_json, report_chat_id, MIN_USER_ID, INSTANCE_ID
+        )
+
+async def get_broadcast_job(pool, job_id:int):
+    async with pool.acquire() as con:
+        return await con.fetchrow("SELECT * FROM broadcast_jobs WHERE id=$1", job_id)
 
+async def claim_broadcast_jobs(pool, running:List[int]) -> List[int]:
+    # UPDATE atomik: job yang belum selesai & tanpa pemilik (atau pemiliknya berhenti checkpoint)
+    # diambil instance ini; instance lain yang berlomba tidak akan mendapat baris yang sama.
+    async with pool.acquire() as con:
+        # job yang masih berjalan di sini tetap dipegang walau satu chunk lama (album, flood wait)
+        await con.execute(
+            "UPDATE broadcast_jobs SET claimed_at=NOW() WHERE owner=$1 AND id = ANY($2::int[])",
+            INSTANCE_ID, running
+        )
+        rows = await con.fetch(
+            """UPDATE broadcast_jobs SET owner=$1, claimed_at=NOW()
+               WHERE NOT done
+                 AND (owner IS NULL OR claimed_at < NOW() - make_interval(secs => $2))
+               RETURNING id""",
+            INSTANCE_ID, float(BROADCAST_CLAIM_TTL)
+        )
+        return sorted(r[0] for r in rows)
+
+async def release_broadcast_jobs(pool):
+    # shutdown normal: lepas klaim supaya instance berikutnya bisa langsung melanjutkan
+    async with pool.acquire() as con:
+        await con.execute("UPDATE broadcast_jobs SET owner=NULL WHERE owner=$1 AND NOT done", INSTANCE_ID)
+
+async def save_broadcast_progress(pool, job_id:int, next_offset:int, total:int, counts:Counter, done:bool=False) -> bool:
+    # False: klaim sudah diambil alih instance lain -> job ini harus berhenti
+    async with pool.acquire() as con:
+        res = await con.execute(
+            """UPDATE broadcast_jobs SET next_offset=$2, total=$3, sent=$4, blocked=$5,
+                 deleted=$6, failed=$7, done=$8, claimed_at=NOW()
+               WHERE id=$1 AND owner=$9""",
+            job_id, next_offset, total, counts["sent"], counts["blocked"],
+            counts["deleted"], counts["failed"], done, INSTANCE_ID
+        )
+        return res.endswith("1")
 
 # ---- Settings helpers (texts & toggles)
 async def _get_setting(pool, key:str, default:str="") -> str:
@@ -257,14 +543,12 @@ async def _set_setting(pool, key:str, value:str):
             key, value
         )
 
-async def _get_bool(pool, key:str, default:bool=False) -> bool:
-    val = await _get_setting(pool, key, "true" if default else "false")
-    return str(val).strip().lower() in ("1","true","yes","on")
+_TRUE_VALUES = ("1","true","yes","on")
 
-async def _toggle_bool(pool, key:str) -> bool:
-    cur = await _get_bool(pool, key, False)
-    await _set_setting(pool, key, "true" if not cur else "false")
-    return not cur
+def _as_bool(val:Optional[str], default:bool=False) -> bool:
+    if val is None:
+        return default
+    return str(val).strip().lower() in _TRUE_VALUES
 
 async def get_welcome_text(pool) -> str:
     return await _get_setting(pool, "welcome_text",
@@ -273,18 +557,48 @@ async def get_welcome_text(pool) -> str:
 async def set_welcome_text(pool, text:str):
     await _set_setting(pool, "welcome_text", text)
 
-async def get_default_text(pool) -> str:
-    return await _get_setting(pool, "default_text",
-        "Halo! Ketik /link untuk melihat tautan promo.")
+async def refresh_welcome_text(bot_data:dict, pool) -> None:
+    bot_data["welcome_text"] = await get_welcome_text(pool)
+
+_DEFAULT_TEXT_FALLBACK = "Halo! Ketik /link untuk melihat tautan promo."
 
 async def set_default_text(pool, text:str):
     await _set_setting(pool, "default_text", text)
 
-async def start_buttons_enabled(pool) -> bool:
-    return await _get_bool(pool, "start_buttons_on", True)
+CACHE_REFRESHERS.update({
+    "admins": (refresh_admins,),
+    "settings": (refresh_admins, refresh_welcome_text),  # owner_id, welcome_text
+})
+
+_BUTTON_TOGGLES = {"start_buttons_on": True, "default_buttons_on": False}  # key -> default
+
+def _button_toggles_from_rows(rows) -> Tuple[bool, bool]:
+    vals = {r["key"]: r["value"] for r in rows}
+    return tuple(_as_bool(vals.get(k), d) for k, d in _BUTTON_TOGGLES.items())
 
-async def default_buttons_enabled(pool) -> bool:
-    return await _get_bool(pool, "default_buttons_on", False)
+async def get_button_toggles(pool) -> Tuple[bool, bool]:
+    # (start_buttons_on, default_buttons_on) dalam satu query untuk panel pengaturan
+    async with pool.acquire() as con:
+        rows = await con.fetch("SELECT key, value FROM settings WHERE key = ANY($1::text[])", list(_BUTTON_TOGGLES))
+    return _button_toggles_from_rows(rows)
+
+async def toggle_button_setting(pool, key:str) -> Tuple[bool, bool]:
+    # balik satu toggle dan baca toggle lainnya dalam satu statement: satu round-trip,
+    # tidak balapan antar admin; hasilnya (start_buttons_on, default_buttons_on) untuk panel
+    async with pool.acquire() as con:
+        rows = await con.fetch(
+            """WITH t AS (
+                 INSERT INTO settings(key,value) VALUES($1,$2)
+                 ON CONFLICT (key) DO UPDATE SET value = CASE
+                   WHEN lower(trim(settings.value)) = ANY($3::text[]) THEN 'false' ELSE 'true' END
+                 RETURNING key, value
+               )
+               SELECT key, value FROM t
+               UNION ALL
+               SELECT key, value FROM settings WHERE key = ANY($4::text[]) AND key <> $1""",
+            key, "false" if _BUTTON_TOGGLES[key] else "true", list(_TRUE_VALUES), list(_BUTTON_TOGGLES)
+        )
+    return _button_toggles_from_rows(rows)
 
 # ---- Promo links (tetap ada, terpisah)
 async def list_links(pool):
@@ -293,9 +607,12 @@ async def list_links(pool):
 
 async def add_link(pool, title:str, url:str):
     async with pool.acquire() as con:
-        maxpos = await con.fetchval("SELECT COALESCE(MAX(position),0) FROM promo_links")
-        nextpos = int(maxpos or 0) + 1
-        await con.execute("INSERT INTO promo_links(title,url,position) VALUES($1,$2,$3)", title, url, nextpos)
+        # posisi dihitung di SQL dalam satu round-trip (posisi kembar tetap terurut lewat id)
+        await con.execute(
+            "INSERT INTO promo_links(title,url,position) "
+            "SELECT $1, $2, COALESCE(MAX(position),0) + 1 FROM promo_links",
+            title, url
+        )
 
 async def delete_link(pool, link_id:int) -> bool:
     async with pool.acquire() as con:
@@ -314,9 +631,11 @@ async def list_start_buttons(pool):
 
 async def add_start_button(pool, text:str, url:str):
     async with pool.acquire() as con:
-        maxpos = await con.fetchval("SELECT COALESCE(MAX(position),0) FROM start_buttons")
-        nextpos = int(maxpos or 0) + 1
-        await con.execute("INSERT INTO start_buttons(text,url,position) VALUES($1,$2,$3)", text, url, nextpos)
+        await con.execute(
+            "INSERT INTO start_buttons(text,url,position) "
+            "SELECT $1, $2, COALESCE(MAX(position),0) + 1 FROM start_buttons",
+            text, url
+        )
 
 async def delete_start_button(pool, btn_id:int) -> bool:
     async with pool.acquire() as con:
@@ -328,11 +647,32 @@ async def list_default_buttons(pool):
     async with pool.acquire() as con:
         return await con.fetch("SELECT id,text,url FROM default_buttons ORDER BY position, id")
 
+# ---- Balasan /start & default: semua query di satu koneksi (satu acquire per balasan)
+async def get_start_buttons_if_enabled(pool) -> Optional[List[asyncpg.Record]]:
+    async with pool.acquire() as con:
+        on = await con.fetchval("SELECT value FROM settings WHERE key='start_buttons_on'")
+        if not _as_bool(on, True):
+            return None
+        return await con.fetch("SELECT id,text,url FROM start_buttons ORDER BY position, id")
+
+async def get_default_reply(pool) -> Tuple[str, Optional[List[asyncpg.Record]]]:
+    async with pool.acquire() as con:
+        row = await con.fetchrow(
+            "SELECT (SELECT value FROM settings WHERE key='default_text') AS text, "
+            "(SELECT value FROM settings WHERE key='default_buttons_on') AS buttons_on"
+        )
+        rows = None
+        if _as_bool(row["buttons_on"], False):
+            rows = await con.fetch("SELECT id,text,url FROM default_buttons ORDER BY position, id")
+    return row["text"] or _DEFAULT_TEXT_FALLBACK, rows
+
 async def add_default_button(pool, text:str, url:str):
     async with pool.acquire() as con:
-        maxpos = await con.fetchval("SELECT COALESCE(MAX(position),0) FROM default_buttons")
-        nextpos = int(maxpos or 0) + 1
-        await con.execute("INSERT INTO default_buttons(text,url,position) VALUES($1,$2,$3)", text, url, nextpos)
+        await con.execute(
+            "INSERT INTO default_buttons(text,url,position) "
+            "SELECT $1, $2, COALESCE(MAX(position),0) + 1 FROM default_buttons",
+            text, url
+        )
 
 async def delete_default_button(pool, btn_id:int) -> bool:
     async with pool.acquire() as con:
@@ -340,29 +680,35 @@ async def delete_default_button(pool, btn_id:int) -> bool:
         return res.endswith("1")
 
 # ---------------- State ----------------
-class Step:
-    ASK_TEXT = "ASK_TEXT"
-    ASK_MEDIA = "ASK_MEDIA"
-    ASK_ADD_BUTTON = "ASK_ADD_BUTTON"
-    ASK_BUTTON_TEXT = "ASK_BUTTON_TEXT"
-    ASK_BUTTON_URL = "ASK_BUTTON_URL"
-    PREVIEW = "PREVIEW"
-    SET_WELCOME = "SET_WELCOME"
-    ADD_LINK_TITLE = "ADD_LINK_TITLE"
-    ADD_LINK_URL = "ADD_LINK_URL"
-    SET_DEFAULT = "SET_DEFAULT"
-    # Baru: add button START / DEFAULT
-    ADD_SB_TEXT = "ADD_SB_TEXT"
-    ADD_SB_URL = "ADD_SB_URL"
-    ADD_DB_TEXT = "ADD_DB_TEXT"
-    ADD_DB_URL = "ADD_DB_URL"
-    IDLE = "IDLE"
+class Step(IntEnum):
+    # int, bukan string: dispatch step (_STEP_HANDLERS/_CB_STEP_TABLE) cukup lookup dict per pesan
+    IDLE = 0
+    ASK_TEXT = 1
+    ASK_MEDIA = 2
+    ASK_ADD_BUTTON = 3
+    ASK_BUTTON_TEXT = 4
+    ASK_BUTTON_URL = 5
+    PREVIEW = 6
+    SET_WELCOME = 7
+    ADD_LINK_TITLE = 8
+    ADD_LINK_URL = 9
+    SET_DEFAULT = 10
+    # add button START / DEFAULT
+    ADD_SB_TEXT = 11
+    ADD_SB_URL = 12
+    ADD_DB_TEXT = 13
+    ADD_DB_URL = 14
 
 @dataclass
 class ButtonDef:
     text: str
     url: str
 
+@dataclass
+class AlbumItem:
+    kind: str  # "photo" | "video"
+    file_id: str
+
 @dataclass
 class BroadcastDraft:
     text: str = ""
@@ -370,63 +716,254 @@ class BroadcastDraft:
     video_file_id: Optional[str] = None
     animation_file_id: Optional[str] = None
     buttons: List[ButtonDef] = field(default_factory=list)
+    # album (>1 foto/video): dikirim satu sendMediaGroup per user, caption di item pertama, tanpa button
+    album: List[AlbumItem] = field(default_factory=list)
+    active_only: bool = False  # True: hanya user dengan last_seen dalam ACTIVE_DAYS
+    # pesan preview (media) yang di-copy ke setiap user saat broadcast
+    source_chat_id: Optional[int] = None
+    source_message_id: Optional[int] = None
+
+    def send_spec(self, kb:Optional[InlineKeyboardMarkup]) -> Tuple[str, Dict[str, Any]]:
+        # (nama method Bot, kwargs) untuk mengirim draft apa adanya; dipakai preview & broadcast
+        if self.photo_file_id:
+            return "send_photo", dict(photo=self.photo_file_id, caption=self.text, parse_mode=ParseMode.HTML, reply_markup=kb)
+        if self.video_file_id:
+            return "send_video", dict(video=self.video_file_id, caption=self.text, parse_mode=ParseMode.HTML, reply_markup=kb)
+        if self.animation_file_id:
+            return "send_animation", dict(animation=self.animation_file_id, caption=self.text,
+                                          parse_mode=ParseMode.HTML, reply_markup=kb)
+        return "send_message", dict(text=self.text, parse_mode=ParseMode.HTML, reply_markup=kb,
+                                    link_preview_options=NO_LINK_PREVIEW)
+
+def draft_to_json(draft:BroadcastDraft) -> str:
+    return json.dumps(asdict(draft))
+
+def draft_from_json(raw:str) -> BroadcastDraft:
+    d = json.loads(raw)
+    d["buttons"] = [ButtonDef(**b) for b in d.get("buttons", [])]
+    d["album"] = [AlbumItem(**a) for a in d.get("album", [])]
+    return BroadcastDraft(**d)
+
+def album_media(draft:BroadcastDraft) -> List:
+    media = []
+    for i, item in enumerate(draft.album):
+        cls = InputMediaPhoto if item.kind == "photo" else InputMediaVideo
+        if i == 0:
+            media.append(cls(item.file_id, caption=draft.text, parse_mode=ParseMode.HTML))
+        else:
+            media.append(cls(item.file_id))
+    return media
 
 @dataclass
 class Session:
-    step: str = Step.IDLE
+    step: Step = Step.IDLE
     draft: BroadcastDraft = field(default_factory=BroadcastDraft)
     temp_button_text: Optional[str] = None
     temp_link_title: Optional[str] = None
     # untuk add tombol start/default
     temp_sb_text: Optional[str] = None
     temp_db_text: Optional[str] = None
+    last_touched: float = field(default_factory=time.time)  # wall clock: ikut tersimpan lintas restart
+
+# Session disimpan di context.user_data["session"] (SessionPersistence, lihat build_app)
+# supaya flow setting/broadcast yang sedang berjalan tidak hilang saat restart/redeploy.
+def ensure_session(context:ContextTypes.DEFAULT_TYPE) -> Session:
+    s = context.user_data.get("session")
+    if s is None:
+        s = context.user_data["session"] = Session()
+    elif isinstance(s.step, str):  # session lama di sessions.pkl masih menyimpan nama step
+        s.step = Step.__members__.get(s.step, Step.IDLE)
+    s.last_touched = time.time()
+    return s
+
+class SessionPersistence(PicklePersistence):
+    # Hanya session admin yang masuk file: user_data kosong (dibuat PTB untuk setiap user biasa)
+    # tidak pernah disimpan, dan perubahan last_touched saja tidak dihitung sebagai perubahan.
+    # on_flush=True: file ditulis flush_sessions secara berkala (dan PTB saat shutdown), bukan
+    # sekali dump penuh per user yang berubah.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, on_flush=True, **kwargs)
+        self.dirty = False
+        self._saved: Dict[int, Session] = {}
+
+    async def update_user_data(self, user_id:int, data:dict) -> None:
+        s = data.get("session")
+        if s is None:
+            return await self.drop_user_data(user_id)
+        snap = deepcopy(s)
+        snap.last_touched = 0.0
+        if self._saved.get(user_id) == snap:
+            return
+        self._saved[user_id] = snap
+        self.dirty = True
+        await super().update_user_data(user_id, data)
 
-sessions: Dict[int, Session] = {}
+    async def drop_user_data(self, user_id:int) -> None:
+        if user_id not in self._saved and not (self.user_data and user_id in self.user_data):
+            return
+        self._saved.pop(user_id, None)
+        self.dirty = True
+        await super().drop_user_data(user_id)
+
+async def flush_sessions(persistence:SessionPersistence, interval:float=SESSION_FLUSH_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        if persistence.dirty:
+            persistence.dirty = False
+            await persistence.flush()
+
+async def gc_sessions(app, interval:float=SESSION_GC_INTERVAL):
+    # session admin yang ditinggal tetap terhapus (juga dari file persistence)
+    while True:
+        await asyncio.sleep(interval)
+        now = time.time()
+        stale = []
+        for uid, data in app.user_data.items():
+            s = data.get("session")
+            if s is None:
+                if not data:  # entri kosong (mis. dibuat PTB untuk user biasa) ikut dibuang
+                    stale.append(uid)
+                continue
+            idle = now - s.last_touched
+            if (idle > SESSION_TTL and s.step == Step.IDLE) or idle > SESSION_STALE_TTL:
+                stale.append(uid)
+        for uid in stale:
+            app.drop_user_data(uid)
+        if stale:
+            log.info("Session GC: dropped %d, kept %d", len(stale), len(app.user_data))
+
+def draft_keyboard(draft:BroadcastDraft) -> Optional[InlineKeyboardMarkup]:
+    # dibangun sekali per preview/broadcast lalu objek yang sama dipakai untuk semua penerima;
+    # None (bukan markup kosong) -> reply_markup tidak ikut diserialisasi & dikirim sama sekali
+    if not draft.buttons:
+        return None
+    return InlineKeyboardMarkup(tuple((InlineKeyboardButton(b.text, url=b.url),) for b in draft.buttons))
 
-def ensure_session(uid:int) -> Session:
-    if uid not in sessions:
-        sessions[uid] = Session()
-    return sessions[uid]
+# broadcast teks tanpa link preview: Telegram tidak perlu fetch URL untuk tiap kiriman
+NO_LINK_PREVIEW = LinkPreviewOptions(is_disabled=True)
 
-def yesno_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("Ya", callback_data="btn_yes"),
-         InlineKeyboardButton("Tidak", callback_data="btn_no")]
-    ])
+# Keyboard statis: dibuat sekali saat import, dipakai ulang di setiap prompt
+YESNO_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Ya", callback_data="y"),
+     InlineKeyboardButton("Tidak", callback_data="n")]
+])
+
+PREVIEW_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Kirim", callback_data="S")],
+    [InlineKeyboardButton("🔁 Ulangi", callback_data="R")],
+    [InlineKeyboardButton("❌ Batal", callback_data="C")],
+])
 
 # ---------------- Health ----------------
-class HealthHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == "/healthz":
-            self.send_response(200); self.end_headers(); self.wfile.write(b"ok")
+# Dilayani langsung di event loop bot (tanpa thread HTTPServer terpisah).
+_ETAG = '"ok-v1"'
+_HEALTH_200 = (
+    "HTTP/1.1 200 OK\r\n"
+    f"ETag: {_ETAG}\r\n"
+    "Cache-Control: max-age=5\r\n"
+    "Content-Type: text/plain\r\n"
+    "Content-Length: 2\r\n"
+    "Connection: close\r\n\r\nok"
+).encode()
+_HEALTH_304 = (
+    "HTTP/1.1 304 Not Modified\r\n"
+    f"ETag: {_ETAG}\r\n"
+    "Connection: close\r\n\r\n"
+).encode()
+_HEALTH_404 = b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+# belum siap (pool DB belum ada): tanpa ETag/cache supaya pinger tidak dapat 304 basi
+_HEALTH_503 = (
+    "HTTP/1.1 503 Service Unavailable\r\n"
+    "Cache-Control: no-store\r\n"
+    "Content-Type: text/plain\r\n"
+    "Content-Length: 9\r\n"
+    "Connection: close\r\n\r\nPOOL-NONE"
+).encode()
+
+async def _health_conn(ready:Callable[[], bool], reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5)
+        lines = head.decode("latin-1").split("\r\n")
+        req = lines[0].split()
+        if len(req) >= 2 and req[0] == "GET" and req[1] == "/healthz":
+            if not ready():
+                writer.write(_HEALTH_503)
+            else:
+                # pinger yang mengirim If-None-Match cukup dapat 304 tanpa body
+                inm = None
+                for ln in lines[1:]:
+                    k, _, v = ln.partition(":")
+                    if k.strip().lower() == "if-none-match":
+                        inm = v.strip()
+                        break
+                writer.write(_HEALTH_304 if inm == _ETAG else _HEALTH_200)
         else:
-            self.send_response(404); self.end_headers()
+            writer.write(_HEALTH_404)
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
 
-def start_health_server():
-    srv = HTTPServer(("0.0.0.0", PORT), HealthHandler)
+async def start_health_server(ready:Callable[[], bool]) -> asyncio.AbstractServer:
+    # satu loop dengan bot: /healthz mencerminkan kondisi bot sebenarnya (503 selama DB belum siap)
+    srv = await asyncio.start_server(partial(_health_conn, ready), "0.0.0.0", PORT)
     log.info("Health server :%s", PORT)
-    srv.serve_forever()
+    return srv
 
 # ---------------- Debug & Tracking ----------------
 async def debug_all(update:Update, context:ContextTypes.DEFAULT_TYPE):
+    # log per update hanya di DEBUG; di level lain tidak ada yang diformat sama sekali
+    if not log.isEnabledFor(logging.DEBUG):
+        return
     if update.message:
-        log.info("UPDATE message chat=%s text=%r", update.message.chat_id, update.message.text)
+        log.debug("UPDATE message chat=%s text=%r", update.message.chat_id, update.message.text)
     elif update.callback_query:
-        step = sessions.get(update.callback_query.from_user.id, Session()).step
-        log.info("UPDATE callback from=%s data=%r (step=%s)", update.callback_query.from_user.id, update.callback_query.data, step)
+        sess = context.user_data.get("session")
+        step = getattr(sess.step, "name", sess.step) if sess else "IDLE"
+        log.debug("UPDATE callback from=%s data=%r (step=%s)", update.callback_query.from_user.id, update.callback_query.data, step)
     elif update.my_chat_member:
-        log.info("UPDATE my_chat_member chat=%s status=%s", update.my_chat_member.chat.id, update.my_chat_member.new_chat_member.status)
+        log.debug("UPDATE my_chat_member chat=%s status=%s", update.my_chat_member.chat.id, update.my_chat_member.new_chat_member.status)
     else:
-        log.info("UPDATE other: %s", update.to_dict())
+        log.debug("UPDATE other id=%s", update.update_id)
 
 async def track(update:Update, context:ContextTypes.DEFAULT_TYPE):
-    pool = get_pool(context)
+    # hanya pesan & tombol yang dihitung aktivitas (bukan my_chat_member, edit, dll.);
+    # cukup masuk antrean, track_writer yang menulis ke DB secara batch
+    if not (update.message or update.callback_query):
+        return
+    queue = context.application.bot_data.get("track_queue")
     u = update.effective_user
-    if pool and u:
-        try:
-            await upsert_user(pool, u.id, u.first_name, u.username)
-        except Exception as e:
-            log.warning("track fail: %s", e)
+    if queue is not None and u:
+        queue.put_nowait((u.id, u.first_name, u.username))
+
+async def track_writer(pool, queue:asyncio.Queue):
+    # Kumpulkan antrean track selama TRACK_FLUSH_INTERVAL detik (maks TRACK_BATCH, dedup per
+    # user) -> satu upsert. Item None = sinyal berhenti dari post_shutdown setelah sisa ditulis.
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await queue.get()
+        stop = item is None
+        deadline = loop.time() + TRACK_FLUSH_INTERVAL
+        batch = {}
+        taken = 0
+        while item is not None:
+            batch[item[0]] = item
+            taken += 1
+            if taken >= TRACK_BATCH:
+                break
+            try:
+                item = await asyncio.wait_for(queue.get(), max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                break
+            stop = stop or item is None
+        if batch:
+            try:
+                await upsert_users(pool, list(batch.values()))
+            except Exception as e:
+                log.warning("track flush fail (%d users): %s", len(batch), e)
+        if stop:
+            return
 
 # ---------------- Helpers ----------------
 def get_pool(context: ContextTypes.DEFAULT_TYPE):
@@ -455,12 +992,23 @@ async def safe_reply(update:Update, text:str, **kwargs):
     except Exception as e:
         log.warning("safe_reply error: %s", e)
 
-_NUM_ID = re.compile(r"(-?\d{4,20})")
-_USERNAME = re.compile(r"^@?([A-Za-z0-9_]{4,})$")
+_NUM_ID = re.compile(r"(-?\d{4,20})", re.ASCII)
+_USERNAME = re.compile(r"^@?([A-Za-z0-9_]{4,})$", re.ASCII)
+
+def _plain_int(t:str) -> Optional[int]:
+    # angka polos (boleh diawali "-") dengan panjang ID yang wajar -> int, selain itu None
+    digits = t[1:] if t.startswith("-") else t
+    if digits.isascii() and digits.isdigit() and 4 <= len(digits) <= 20:
+        return int(t)
+    return None
 
 def _first_int_from_text(text:str) -> Optional[int]:
     if not text:
         return None
+    # kasus umum: argumen berupa angka saja -> tanpa regex
+    uid = _plain_int(text.strip())
+    if uid is not None:
+        return uid
     m = _NUM_ID.search(text)
     if m:
         try:
@@ -482,7 +1030,10 @@ async def resolve_user_id(update:Update, context:ContextTypes.DEFAULT_TYPE) -> T
     text = (update.message.text if update.message and update.message.text else "")
     args = context.args if hasattr(context, "args") else []
 
-    uid = _first_int_from_text(" ".join(args) if args else text)
+    # /cmd 123456789 -> args[0] langsung int, tanpa join & regex
+    uid = _plain_int(args[0]) if args else None
+    if uid is None:
+        uid = _first_int_from_text(" ".join(args) if args else text)
     if uid:
         return uid, "numeric"
 
@@ -504,16 +1055,8 @@ async def resolve_user_id(update:Update, context:ContextTypes.DEFAULT_TYPE) -> T
     return None, None
 
 # ---------------- Permission ----------------
-async def ensure_admin(update:Update, context:ContextTypes.DEFAULT_TYPE) -> bool:
-    pool = get_pool(context)
-    if not pool:
-        await safe_reply(update, "⚠️ Bot belum siap (DB belum terhubung). Coba lagi sebentar.")
-        return False
-    uid = update.effective_user.id
-    if not await is_admin(pool, uid):
-        await safe_reply(update, "Maaf, perintah ini khusus admin.")
-        return False
-    return True
+async def not_admin_cmd(update:Update, context:ContextTypes.DEFAULT_TYPE):
+    await safe_reply(update, "Maaf, perintah ini khusus admin.")
 
 async def ensure_owner(update:Update, context:ContextTypes.DEFAULT_TYPE) -> bool:
     pool = get_pool(context)
@@ -521,8 +1064,7 @@ async def ensure_owner(update:Update, context:ContextTypes.DEFAULT_TYPE) -> bool
         await safe_reply(update, "⚠️ Bot belum siap (DB belum terhubung). Coba lagi sebentar.")
         return False
     uid = update.effective_user.id
-    owner_id = await get_owner_id(pool)
-    if uid != owner_id:
+    if uid != owner_id_sync(context.application.bot_data):
         await safe_reply(update, "Hanya OWNER.")
         return False
     return True
@@ -545,6 +1087,19 @@ def _link_keyboard_admin(rows: List[asyncpg.Record]) -> InlineKeyboardMarkup:
     kb_rows.append([InlineKeyboardButton("➕ Tambah Link", callback_data="link_add")])
     return InlineKeyboardMarkup(kb_rows)
 
+# ---- Promo links cache: keyboard user & admin dibangun sekali per perubahan, bukan per /link
+async def refresh_links(bot_data:dict, pool) -> None:
+    rows = await list_links(pool)
+    bot_data["links_kb"] = (_link_keyboard_for_all(rows), _link_keyboard_admin(rows))
+
+async def link_keyboards(context:ContextTypes.DEFAULT_TYPE, pool) -> Tuple[InlineKeyboardMarkup, InlineKeyboardMarkup]:
+    bot_data = context.application.bot_data
+    if "links_kb" not in bot_data:
+        await refresh_links(bot_data, pool)
+    return bot_data["links_kb"]
+
+CACHE_REFRESHERS["promo_links"] = (refresh_links,)
+
 def _start_buttons_admin(rows: List[asyncpg.Record]) -> InlineKeyboardMarkup:
     kb = [
         [InlineKeyboardButton(r["text"], url=r["url"]),
@@ -568,32 +1123,25 @@ async def start_cmd(update:Update, context:ContextTypes.DEFAULT_TYPE):
     pool = get_pool(context)
     if not pool:
         return await safe_reply(update, "🤖 Bot sedang inisialisasi. Coba lagi sebentar.")
-    welcome_text = await get_welcome_text(pool)
-    use_buttons = await start_buttons_enabled(pool)
-    kb = None
-    if use_buttons:
-        rows = await list_start_buttons(pool)
-        kb = _keyboard_from_rows(rows)
+    # dari cache bot_data (diisi saat start & setiap kali diubah); DB hanya fallback
+    welcome_text = context.application.bot_data.get("welcome_text") or await get_welcome_text(pool)
+    rows = await get_start_buttons_if_enabled(pool)
+    kb = _keyboard_from_rows(rows) if rows is not None else None
     await safe_reply(update, welcome_text, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
 
 async def ping_cmd(update:Update, context:ContextTypes.DEFAULT_TYPE):
-    if not await ensure_admin(update, context):
-        return
     await safe_reply(update, "koneksi bot dengan server aman bro")
 
 async def stats_cmd(update:Update, context:ContextTypes.DEFAULT_TYPE):
-    if not await ensure_admin(update, context):
-        return
     pool = get_pool(context)
     total = await count_users(pool)
     await safe_reply(update, f"👥 Total pengguna terdaftar: {total}")
 
 async def admins_cmd(update:Update, context:ContextTypes.DEFAULT_TYPE):
-    if not await ensure_admin(update, context):
-        return
-    pool = get_pool(context)
-    ids = await get_admins(pool)
-    owner_id = await get_owner_id(pool)
+    # langsung dari cache (owner + admin set), tanpa query
+    bot_data = context.application.bot_data
+    owner_id = owner_id_sync(bot_data)
+    ids = [owner_id] + sorted(i for i in bot_data.get("admins", ()) if i != owner_id)
     lines = []
     for i in ids:
         tag = "OWNER" if i == owner_id else "ADMIN"
@@ -612,6 +1160,7 @@ async def admin_add_cmd(update:Update, context:ContextTypes.DEFAULT_TYPE):
             hint = f"\nCatatan: tidak bisa resolve username @{how.split(':',1)[1]} ke ID. Reply ke pesan user target atau gunakan user_id numerik."
         return await safe_reply(update, "Gunakan /admin_add <user_id> atau reply pesan user." + hint)
     ok = await add_admin(pool, target_id)
+    await refresh_admins(context.application.bot_data, pool)
     await safe_reply(update, ("✅ Berhasil" if ok else "❌ Gagal/duplikat") + f" menambah admin: {target_id}")
 
 async def admin_del_cmd(update:Update, context:ContextTypes.DEFAULT_TYPE):
@@ -622,20 +1171,13 @@ async def admin_del_cmd(update:Update, context:ContextTypes.DEFAULT_TYPE):
     if not target_id:
         return await safe_reply(update, "Gunakan /admin_del <user_id> atau reply pesan user.")
     ok = await del_admin(pool, target_id)
+    await refresh_admins(context.application.bot_data, pool)
     if not ok:
         return await safe_reply(update, f"❌ Gagal menghapus admin {target_id} (mungkin bukan admin / mencoba hapus OWNER).")
     await safe_reply(update, f"✅ Admin dihapus: {target_id}")
 
 async def owner_show_cmd(update:Update, context:ContextTypes.DEFAULT_TYPE):
-    pool = get_pool(context)
-    if not pool:
-        return await safe_reply(update, "🤖 Bot sedang inisialisasi. Coba lagi sebentar.")
-    uid = update.effective_user.id
-    isadm = await is_admin(pool, uid)
-    if not isadm:
-        return await safe_reply(update, "Maaf, perintah ini khusus admin.")
-    owner_id = await get_owner_id(pool)
-    await safe_reply(update, f"👑 OWNER saat ini: {owner_id}")
+    await safe_reply(update, f"👑 OWNER saat ini: {owner_id_sync(context.application.bot_data)}")
 
 async def owner_set_cmd(update:Update, context:ContextTypes.DEFAULT_TYPE):
     if not await ensure_owner(update, context):
@@ -646,6 +1188,7 @@ async def owner_set_cmd(update:Update, context:ContextTypes.DEFAULT_TYPE):
         return await safe_reply(update, "Gunakan /owner_set <user_id> atau reply pesan user untuk memindahkan kepemilikan.")
     await set_owner_id(pool, target_id)
     await del_admin(pool, target_id)  # opsional
+    await refresh_admins(context.application.bot_data, pool)
     await safe_reply(update, f"✅ OWNER dipindahkan ke: {target_id}")
 
 # ---------------- HELP ----------------
@@ -657,7 +1200,7 @@ async def help_cmd(update:Update, context:ContextTypes.DEFAULT_TYPE):
         )
 
     uid = update.effective_user.id
-    isadm = await is_admin(pool, uid)
+    isadm = is_admin_sync(context.application.bot_data, uid)
 
     if not isadm:
         pub = (
@@ -677,6 +1220,7 @@ async def help_cmd(update:Update, context:ContextTypes.DEFAULT_TYPE):
         "/owner_show - Lihat OWNER\n"
         "/owner_set - Pindah OWNER\n"
         "/broadcast - Mulai broadcast\n"
+        f"/broadcast_active - Broadcast ke user aktif ({ACTIVE_DAYS} hari)\n"
         "/setting - Panel pengaturan\n"
         "/link - Lihat/kelola link\n"
         "/ping - Tes koneksi\n"
@@ -689,20 +1233,20 @@ async def link_cmd(update:Update, context:ContextTypes.DEFAULT_TYPE):
     if not pool:
         return await safe_reply(update, "⚠️ Bot belum siap (DB belum terhubung).")
     uid = update.effective_user.id
-    isadm = await is_admin(pool, uid)
-    rows = await list_links(pool)
+    isadm = is_admin_sync(context.application.bot_data, uid)
+    kb_all, kb_admin = await link_keyboards(context, pool)
     if isadm:
         return await safe_reply(
             update,
             "🔗 <b>Link Promo</b>\nAdmin dapat menambah/hapus link dari tombol di bawah.\n(Catatan: tidak mempengaruhi tombol /start dan Pesan Default)",
-            reply_markup=_link_keyboard_admin(rows),
+            reply_markup=kb_admin,
             parse_mode=ParseMode.HTML
         )
     else:
         return await safe_reply(
             update,
             "🔗 <b>Link Promo</b>\n𝐋𝐈𝐒𝐓 𝐋𝐈𝐍𝐊 𝐏𝐑𝐎𝐌𝐎 𝐃𝐀𝐍 𝐋𝐈𝐍𝐊 𝐀𝐋𝐓𝐄𝐑𝐍𝐀𝐓𝐈𝐅",
-            reply_markup=_link_keyboard_for_all(rows),
+            reply_markup=kb_all,
             parse_mode=ParseMode.HTML
         )
 
@@ -721,11 +1265,8 @@ def _settings_menu_markup(start_on:bool, default_on:bool) -> InlineKeyboardMarku
     ])
 
 async def setting_cmd(update:Update, context:ContextTypes.DEFAULT_TYPE):
-    if not await ensure_admin(update, context):
-        return
     pool = get_pool(context)
-    start_on = await start_buttons_enabled(pool)
-    default_on = await default_buttons_enabled(pool)
+    start_on, default_on = await get_button_toggles(pool)
     await safe_reply(
         update,
         "<b>Panel Pengaturan</b>\n\n"
@@ -737,215 +1278,344 @@ async def setting_cmd(update:Update, context:ContextTypes.DEFAULT_TYPE):
     )
 
 # ---------------- Broadcast helpers & flow ----------------
-@dataclass
-class BroadcastDraft:
-    text: str = ""
-    photo_file_id: Optional[str] = None
-    video_file_id: Optional[str] = None
-    animation_file_id: Optional[str] = None
-    buttons: List[ButtonDef] = field(default_factory=list)
-
 async def send_preview_to_chat(context:ContextTypes.DEFAULT_TYPE, chat_id:int, draft:BroadcastDraft):
-    rows = [[InlineKeyboardButton(b.text, url=b.url)] for b in draft.buttons]
-    kb = InlineKeyboardMarkup(rows) if rows else InlineKeyboardMarkup([])
-    caption = draft.text or ""
-    if draft.photo_file_id:
-        await context.bot.send_photo(chat_id, draft.photo_file_id, caption=caption, parse_mode=ParseMode.HTML, reply_markup=kb)
-    elif draft.video_file_id:
-        await context.bot.send_video(chat_id, draft.video_file_id, caption=caption, parse_mode=ParseMode.HTML, reply_markup=kb)
-    elif draft.animation_file_id:
-        await context.bot.send_animation(chat_id, draft.animation_file_id, caption=caption, parse_mode=ParseMode.HTML, reply_markup=kb)
-    else:
-        await context.bot.send_message(chat_id, caption, parse_mode=ParseMode.HTML, reply_markup=kb)
+    if draft.album:
+        await context.bot.send_media_group(chat_id, album_media(draft))
+        return await context.bot.send_message(chat_id, "Preview album di atas. Lanjutkan?", reply_markup=PREVIEW_KB)
+    method, kwargs = draft.send_spec(draft_keyboard(draft))
+    preview = await getattr(context.bot, method)(chat_id, **kwargs)
+    # pesan preview (media maupun teks) jadi sumber copy_message saat broadcast: request per user
+    # hanya berisi chat/message id, tanpa teks/caption yang harus di-parse ulang Telegram
+    draft.source_chat_id = chat_id
+    draft.source_message_id = preview.message_id
     await context.bot.send_message(
         chat_id,
         "Preview di atas. Lanjutkan?",
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("✅ Kirim", callback_data="preview_send")],
-            [InlineKeyboardButton("🔁 Ulangi", callback_data="preview_restart")],
-            [InlineKeyboardButton("❌ Batal", callback_data="preview_cancel")],
-        ]),
+        reply_markup=PREVIEW_KB,
     )
 
+# ---------------- Per-user serialization ----------------
+# Update diproses paralel (concurrent_updates), tapi flow session tiap user harus berurutan:
+# satu asyncio.Lock per user (LRU), dan user yang membanjiri bot ditolak setelah USER_QUEUE_DEPTH
+# update antre, supaya memori & tulisan DB per user tetap terbatas.
+_user_locks: "OrderedDict[int, asyncio.Lock]" = OrderedDict()
+_user_depth: Counter = Counter()
+
+def _user_lock(uid:int) -> asyncio.Lock:
+    lock = _user_locks.get(uid)
+    if lock is None:
+        lock = _user_locks[uid] = asyncio.Lock()
+        if len(_user_locks) > USER_LOCKS_MAX:
+            # buang lock tertua yang sedang tidak dipakai siapa pun
+            for old_uid, old_lock in _user_locks.items():
+                if not old_lock.locked() and not _user_depth[old_uid]:
+                    del _user_locks[old_uid]
+                    _user_depth.pop(old_uid, None)
+                    break
+    else:
+        _user_locks.move_to_end(uid)
+    return lock
+
+@asynccontextmanager
+async def _user_turn(uid:int):
+    # giliran user: dihitung di _user_depth selama menunggu & memegang lock, sehingga
+    # eviction LRU di _user_lock tidak membuang lock yang sedang ditunggu
+    _user_depth[uid] += 1
+    try:
+        async with _user_lock(uid):
+            yield
+    finally:
+        _user_depth[uid] -= 1
+        if not _user_depth[uid]:
+            del _user_depth[uid]
+
+def serialized_per_user(busy_text:str):
+    def deco(fn:Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[Any]]):
+        @wraps(fn)
+        async def wrapper(update:Update, context:ContextTypes.DEFAULT_TYPE):
+            user = update.effective_user
+            if not user:
+                return await fn(update, context)
+            uid = user.id
+            msg = update.effective_message
+            # item album datang beruntun sekaligus; tetap diantre, jangan ditolak
+            if _user_depth[uid] >= USER_QUEUE_DEPTH and not (msg and msg.media_group_id):
+                if update.callback_query:
+                    return await update.callback_query.answer(busy_text)
+                return await safe_reply(update, busy_text)
+            async with _user_turn(uid):
+                return await fn(update, context)
+        return wrapper
+    return deco
+
+@serialized_per_user("⏳ Pesan sebelumnya masih diproses, tunggu sebentar ya.")
 async def broadcast_cmd(update:Update, context:ContextTypes.DEFAULT_TYPE):
-    if not await ensure_admin(update, context):
-        return
-    uid = update.effective_user.id
-    s = ensure_session(uid)
+    s = ensure_session(context)
     s.step = Step.ASK_TEXT
     s.draft = BroadcastDraft()
     await safe_reply(update, "Kirimkan <b>teks</b> untuk broadcast.", parse_mode=ParseMode.HTML)
 
+@serialized_per_user("⏳ Pesan sebelumnya masih diproses, tunggu sebentar ya.")
+async def broadcast_active_cmd(update:Update, context:ContextTypes.DEFAULT_TYPE):
+    s = ensure_session(context)
+    s.step = Step.ASK_TEXT
+    s.draft = BroadcastDraft(active_only=True)
+    await safe_reply(update,
+        f"Broadcast ke pengguna aktif ({ACTIVE_DAYS} hari terakhir).\nKirimkan <b>teks</b> untuk broadcast.",
+        parse_mode=ParseMode.HTML)
+
 # ---------------- Default reply helper ----------------
 async def send_default_reply(update:Update, context:ContextTypes.DEFAULT_TYPE):
     pool = get_pool(context)
     if not pool:
         return
-    txt = await get_default_text(pool)
-    use_buttons = await default_buttons_enabled(pool)
-    kb = None
-    if use_buttons:
-        rows = await list_default_buttons(pool)
-        kb = _keyboard_from_rows(rows)
+    txt, rows = await get_default_reply(pool)
+    kb = _keyboard_from_rows(rows) if rows is not None else None
     await safe_reply(update, txt, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
 
+# ---------------- Album (media group) collection ----------------
+_album_timers: Dict[int, asyncio.Task] = {}
+
+def _schedule_album_done(context:ContextTypes.DEFAULT_TYPE, chat_id:int, s:Session) -> None:
+    prev = _album_timers.get(chat_id)
+    if prev:
+        prev.cancel()
+    # lewat application.create_task: exception tak terduga sampai ke on_error, tidak hilang diam-diam
+    _album_timers[chat_id] = context.application.create_task(_album_done(context, chat_id, s))
+
+async def _album_done(context:ContextTypes.DEFAULT_TYPE, chat_id:int, s:Session) -> None:
+    await asyncio.sleep(ALBUM_WAIT)
+    _album_timers.pop(chat_id, None)
+    # chat privat: chat_id == user id -> antre bersama update user itu (mis. /broadcast baru)
+    async with _user_turn(chat_id):
+        try:
+            await _finish_album(context, chat_id, s)
+        finally:
+            # timer berjalan di luar update: tandai session supaya perubahan step/draft ikut disimpan
+            context.application.mark_data_for_update_persistence(user_ids=chat_id)
+
+async def _finish_album(context:ContextTypes.DEFAULT_TYPE, chat_id:int, s:Session) -> None:
+    if s.step != Step.ASK_MEDIA or not s.draft.album:
+        return
+    # sendMediaGroup tidak mendukung inline keyboard -> langsung ke preview
+    s.step = Step.PREVIEW
+    try:
+        await context.bot.send_message(chat_id, f"Album {len(s.draft.album)} item diterima (album tidak bisa diberi button).")
+        await send_preview_to_chat(context, chat_id, s.draft)
+    except TelegramError as e:
+        # mis. caption > 1024 karakter: admin diberi tahu dan kembali ke langkah media
+        log.warning("Album preview failed for %s: %s", chat_id, e)
+        s.step = Step.ASK_MEDIA
+        s.draft.album = []
+        await context.bot.send_message(
+            chat_id, f"❌ Album gagal dipreview: {e}\nKirim ulang foto/GIF/video atau ketik skip."
+        )
+
 # ---------------- Message flow (admin steps + public default)
+# Ubah teks welcome
+async def _step_set_welcome(update:Update, context:ContextTypes.DEFAULT_TYPE, s:Session, pool):
+    msg = update.effective_message
+    cleaned = sanitize_welcome(msg.text or "")
+    if not cleaned or cleaned.startswith("/") or cleaned.lower() in ("/start", "/setting"):
+        return await safe_reply(
+            update,
+            "Pesan terlihat masih mengandung command. Kirim ulang teks sambutan <b>tanpa</b> /start atau /setting.",
+            parse_mode=ParseMode.HTML
+        )
+    await set_welcome_text(pool, cleaned)
+    context.application.bot_data["welcome_text"] = cleaned
+    s.step = Step.IDLE
+    start_on, default_on = await get_button_toggles(pool)
+    return await safe_reply(update, "✅ Pesan sambutan berhasil diperbarui.",
+                            reply_markup=_settings_menu_markup(start_on, default_on))
+
+# Ubah teks default
+async def _step_set_default(update:Update, context:ContextTypes.DEFAULT_TYPE, s:Session, pool):
+    msg = update.effective_message
+    cleaned = sanitize_welcome(msg.text or "")
+    if not cleaned or cleaned.startswith("/") or cleaned.lower() in ("/start", "/setting"):
+        return await safe_reply(
+            update,
+            "Kirim ulang <b>teks default</b> (tanpa menyertakan /start atau /setting).",
+            parse_mode=ParseMode.HTML
+        )
+    await set_default_text(pool, cleaned)
+    s.step = Step.IDLE
+    start_on, default_on = await get_button_toggles(pool)
+    return await safe_reply(update, "✅ Pesan default berhasil diperbarui.",
+                            reply_markup=_settings_menu_markup(start_on, default_on))
+
+# Tambah tombol START
+async def _step_add_sb_text(update:Update, context:ContextTypes.DEFAULT_TYPE, s:Session, pool):
+    msg = update.effective_message
+    if not msg.text:
+        return await safe_reply(update, "Kirim <b>teks tombol</b> /start.", parse_mode=ParseMode.HTML)
+    s.temp_sb_text = msg.text.strip()
+    s.step = Step.ADD_SB_URL
+    return await safe_reply(update, "Kirim <b>URL tombol</b> /start (harus http/https).", parse_mode=ParseMode.HTML)
+
+async def _step_add_sb_url(update:Update, context:ContextTypes.DEFAULT_TYPE, s:Session, pool):
+    msg = update.effective_message
+    if not _valid_url(msg.text):
+        return await safe_reply(update, "URL tidak valid. Contoh: https://example.com")
+    await add_start_button(pool, s.temp_sb_text, msg.text.strip())
+    s.temp_sb_text = None
+    s.step = Step.IDLE
+    rows = await list_start_buttons(pool)
+    return await safe_reply(update, "✅ Tombol /start ditambahkan.",
+                            reply_markup=_start_buttons_admin(rows))
+
+# Tambah tombol DEFAULT
+async def _step_add_db_text(update:Update, context:ContextTypes.DEFAULT_TYPE, s:Session, pool):
+    msg = update.effective_message
+    if not msg.text:
+        return await safe_reply(update, "Kirim <b>teks tombol</b> Default.", parse_mode=ParseMode.HTML)
+    s.temp_db_text = msg.text.strip()
+    s.step = Step.ADD_DB_URL
+    return await safe_reply(update, "Kirim <b>URL tombol</b> Default (harus http/https).", parse_mode=ParseMode.HTML)
+
+async def _step_add_db_url(update:Update, context:ContextTypes.DEFAULT_TYPE, s:Session, pool):
+    msg = update.effective_message
+    if not _valid_url(msg.text):
+        return await safe_reply(update, "URL tidak valid. Contoh: https://example.com")
+    await add_default_button(pool, s.temp_db_text, msg.text.strip())
+    s.temp_db_text = None
+    s.step = Step.IDLE
+    rows = await list_default_buttons(pool)
+    return await safe_reply(update, "✅ Tombol Default ditambahkan.",
+                            reply_markup=_default_buttons_admin(rows))
+
+# Tambah link promo
+async def _step_add_link_title(update:Update, context:ContextTypes.DEFAULT_TYPE, s:Session, pool):
+    msg = update.effective_message
+    if not msg.text:
+        return await safe_reply(update, "Kirim judul link (teks).")
+    s.temp_link_title = msg.text.strip()
+    s.step = Step.ADD_LINK_URL
+    return await safe_reply(update, "Kirim URL link (harus diawali http/https).")
+
+async def _step_add_link_url(update:Update, context:ContextTypes.DEFAULT_TYPE, s:Session, pool):
+    msg = update.effective_message
+    if not _valid_url(msg.text):
+        return await safe_reply(update, "URL tidak valid. Contoh: https://example.com")
+    await add_link(pool, s.temp_link_title, msg.text.strip())
+    s.temp_link_title = None
+    s.step = Step.IDLE
+    await refresh_links(context.application.bot_data, pool)
+    _, kb_admin = context.application.bot_data["links_kb"]
+    return await safe_reply(
+        update, 
+        "✅ Link promo ditambahkan.", 
+        reply_markup=kb_admin,
+        parse_mode=ParseMode.HTML
+    )
+
+# Broadcast flow
+async def _step_ask_text(update:Update, context:ContextTypes.DEFAULT_TYPE, s:Session, pool):
+    msg = update.effective_message
+    if not msg.text or msg.text.strip().lower() in ("/broadcast", "/broadcast_active"):
+        return await safe_reply(update, "Silakan kirim teks isi broadcast.")
+    text_html = getattr(msg, "text_html", None) or msg.text
+    s.draft.text = text_html
+    s.step = Step.ASK_MEDIA
+    return await safe_reply(update, "Kirimkan <b>foto/GIF/video</b> (opsional) atau ketik <b>skip</b>.", parse_mode=ParseMode.HTML)
+
+async def _step_ask_media(update:Update, context:ContextTypes.DEFAULT_TYPE, s:Session, pool):
+    msg = update.effective_message
+    if msg.media_group_id and (msg.photo or msg.video):
+        # album datang sebagai beberapa update; kumpulkan lalu lanjut setelah ALBUM_WAIT hening
+        if len(s.draft.album) < ALBUM_MAX:
+            if msg.photo:
+                s.draft.album.append(AlbumItem("photo", msg.photo[-1].file_id))
+            else:
+                s.draft.album.append(AlbumItem("video", msg.video.file_id))
+        s.draft.photo_file_id = s.draft.video_file_id = s.draft.animation_file_id = None
+        return _schedule_album_done(context, update.effective_chat.id, s)
+    if msg.text and msg.text.strip().lower() == "skip":
+        s.step = Step.ASK_ADD_BUTTON
+        return await safe_reply(update, "Tambah <b>button</b>?", reply_markup=YESNO_KB, parse_mode=ParseMode.HTML)
+    s.draft.album = []
+    if msg.photo:
+        s.draft.photo_file_id = msg.photo[-1].file_id
+        s.draft.video_file_id = None
+        s.draft.animation_file_id = None
+    elif msg.video:
+        s.draft.video_file_id = msg.video.file_id
+        s.draft.photo_file_id = None
+        s.draft.animation_file_id = None
+    elif msg.animation:
+        s.draft.animation_file_id = msg.animation.file_id
+        s.draft.photo_file_id = None
+        s.draft.video_file_id = None
+    else:
+        return await safe_reply(update, "Format tidak dikenali. Kirim foto/GIF/video atau <b>skip</b>.", parse_mode=ParseMode.HTML)
+    s.step = Step.ASK_ADD_BUTTON
+    return await safe_reply(update, "Tambah <b>button</b>?", reply_markup=YESNO_KB, parse_mode=ParseMode.HTML)
+
+async def _step_ask_add_button(update:Update, context:ContextTypes.DEFAULT_TYPE, s:Session, pool):
+    msg = update.effective_message
+    if not msg.text:
+        return False
+    txt = msg.text.strip().lower()
+    if txt in ("ya", "yes", "y"):
+        s.step = Step.ASK_BUTTON_TEXT
+        return await safe_reply(update, "Kirim <b>teks button</b> (contoh: Kunjungi Situs)", parse_mode=ParseMode.HTML)
+    if txt in ("tidak", "no", "n"):
+        s.step = Step.PREVIEW
+        return await send_preview_to_chat(context, update.effective_chat.id, s.draft)
+    return False  # bukan ya/tidak -> lanjut ke balasan default
+
+async def _step_ask_button_text(update:Update, context:ContextTypes.DEFAULT_TYPE, s:Session, pool):
+    msg = update.effective_message
+    if not msg.text:
+        return await safe_reply(update, "Kirim teks button (misal: Kunjungi Situs).")
+    s.temp_button_text = msg.text.strip()
+    s.step = Step.ASK_BUTTON_URL
+    return await safe_reply(update, "Kirim URL button (harus diawali http/https).")
+
+async def _step_ask_button_url(update:Update, context:ContextTypes.DEFAULT_TYPE, s:Session, pool):
+    msg = update.effective_message
+    if not _valid_url(msg.text):
+        return await safe_reply(update, "URL tidak valid. Contoh: https://example.com")
+    s.draft.buttons.append(ButtonDef(text=s.temp_button_text, url=msg.text.strip()))
+    s.temp_button_text = None
+    s.step = Step.ASK_ADD_BUTTON
+    return await safe_reply(update, "Tambah button lagi?", reply_markup=YESNO_KB)
+
+# step admin -> handler pesan; handler mengembalikan False bila pesan tidak ditangani
+_STEP_HANDLERS: Dict[Step, Callable[..., Awaitable[Any]]] = {
+    Step.SET_WELCOME: _step_set_welcome,
+    Step.SET_DEFAULT: _step_set_default,
+    Step.ADD_SB_TEXT: _step_add_sb_text,
+    Step.ADD_SB_URL: _step_add_sb_url,
+    Step.ADD_DB_TEXT: _step_add_db_text,
+    Step.ADD_DB_URL: _step_add_db_url,
+    Step.ADD_LINK_TITLE: _step_add_link_title,
+    Step.ADD_LINK_URL: _step_add_link_url,
+    Step.ASK_TEXT: _step_ask_text,
+    Step.ASK_MEDIA: _step_ask_media,
+    Step.ASK_ADD_BUTTON: _step_ask_add_button,
+    Step.ASK_BUTTON_TEXT: _step_ask_button_text,
+    Step.ASK_BUTTON_URL: _step_ask_button_url,
+}
+
+@serialized_per_user("⏳ Pesan sebelumnya masih diproses, tunggu sebentar ya.")
 async def handle_message(update:Update, context:ContextTypes.DEFAULT_TYPE):
     pool = get_pool(context)
     uid = update.effective_user.id
-    s = ensure_session(uid)
     msg = update.effective_message
 
     if not pool:
         return
 
-    isadm = await is_admin(pool, uid)
+    isadm = is_admin_sync(context.application.bot_data, uid)
 
-    # ADMIN FLOWS
+    # ADMIN FLOWS (user biasa tidak pernah dibuatkan session)
     if isadm:
-        # Ubah teks welcome
-        if s.step == Step.SET_WELCOME:
-            cleaned = sanitize_welcome(msg.text or "")
-            if not cleaned or cleaned.startswith("/") or cleaned.lower() in ("/start", "/setting"):
-                return await safe_reply(
-                    update,
-                    "Pesan terlihat masih mengandung command. Kirim ulang teks sambutan <b>tanpa</b> /start atau /setting.",
-                    parse_mode=ParseMode.HTML
-                )
-            await set_welcome_text(pool, cleaned)
-            s.step = Step.IDLE
-            start_on = await start_buttons_enabled(pool)
-            default_on = await default_buttons_enabled(pool)
-            return await safe_reply(update, "✅ Pesan sambutan berhasil diperbarui.",
-                                    reply_markup=_settings_menu_markup(start_on, default_on))
-
-        # Ubah teks default
-        if s.step == Step.SET_DEFAULT:
-            cleaned = sanitize_welcome(msg.text or "")
-            if not cleaned or cleaned.startswith("/") or cleaned.lower() in ("/start", "/setting"):
-                return await safe_reply(
-                    update,
-                    "Kirim ulang <b>teks default</b> (tanpa menyertakan /start atau /setting).",
-                    parse_mode=ParseMode.HTML
-                )
-            await set_default_text(pool, cleaned)
-            s.step = Step.IDLE
-            start_on = await start_buttons_enabled(pool)
-            default_on = await default_buttons_enabled(pool)
-            return await safe_reply(update, "✅ Pesan default berhasil diperbarui.",
-                                    reply_markup=_settings_menu_markup(start_on, default_on))
-
-        # Tambah tombol START
-        if s.step == Step.ADD_SB_TEXT:
-            if not msg.text:
-                return await safe_reply(update, "Kirim <b>teks tombol</b> /start.", parse_mode=ParseMode.HTML)
-            s.temp_sb_text = msg.text.strip()
-            s.step = Step.ADD_SB_URL
-            return await safe_reply(update, "Kirim <b>URL tombol</b> /start (harus http/https).", parse_mode=ParseMode.HTML)
-
-        if s.step == Step.ADD_SB_URL:
-            if not msg.text or not msg.text.strip().lower().startswith(("http://", "https://")):
-                return await safe_reply(update, "URL tidak valid. Contoh: https://example.com")
-            await add_start_button(pool, s.temp_sb_text, msg.text.strip())
-            s.temp_sb_text = None
-            s.step = Step.IDLE
-            rows = await list_start_buttons(pool)
-            return await safe_reply(update, "✅ Tombol /start ditambahkan.",
-                                    reply_markup=_start_buttons_admin(rows))
-
-        # Tambah tombol DEFAULT
-        if s.step == Step.ADD_DB_TEXT:
-            if not msg.text:
-                return await safe_reply(update, "Kirim <b>teks tombol</b> Default.", parse_mode=ParseMode.HTML)
-            s.temp_db_text = msg.text.strip()
-            s.step = Step.ADD_DB_URL
-            return await safe_reply(update, "Kirim <b>URL tombol</b> Default (harus http/https).", parse_mode=ParseMode.HTML)
-
-        if s.step == Step.ADD_DB_URL:
-            if not msg.text or not msg.text.strip().lower().startswith(("http://", "https://")):
-                return await safe_reply(update, "URL tidak valid. Contoh: https://example.com")
-            await add_default_button(pool, s.temp_db_text, msg.text.strip())
-            s.temp_db_text = None
-            s.step = Step.IDLE
-            rows = await list_default_buttons(pool)
-            return await safe_reply(update, "✅ Tombol Default ditambahkan.",
-                                    reply_markup=_default_buttons_admin(rows))
-
-        # Tambah link promo
-        if s.step == Step.ADD_LINK_TITLE:
-            if not msg.text:
-                return await safe_reply(update, "Kirim judul link (teks).")
-            s.temp_link_title = msg.text.strip()
-            s.step = Step.ADD_LINK_URL
-            return await safe_reply(update, "Kirim URL link (harus diawali http/https).")
-
-        if s.step == Step.ADD_LINK_URL:
-            if not msg.text or not msg.text.strip().lower().startswith(("http://", "https://")):
-                return await safe_reply(update, "URL tidak valid. Contoh: https://example.com")
-            await add_link(pool, s.temp_link_title, msg.text.strip())
-            s.temp_link_title = None
-            s.step = Step.IDLE
-            rows = await list_links(pool)
-            return await safe_reply(
-                update, 
-                "✅ Link promo ditambahkan.", 
-                reply_markup=_link_keyboard_admin(rows),
-                parse_mode=ParseMode.HTML
-            )
-
-        # Broadcast flow
-        if s.step == Step.ASK_TEXT:
-            if not msg.text or msg.text.strip().lower() == "/broadcast":
-                return await safe_reply(update, "Silakan kirim teks isi broadcast.")
-            text_html = getattr(msg, "text_html", None) or msg.text
-            s.draft.text = text_html
-            s.step = Step.ASK_MEDIA
-            return await safe_reply(update, "Kirimkan <b>foto/GIF/video</b> (opsional) atau ketik <b>skip</b>.", parse_mode=ParseMode.HTML)
-
-        if s.step == Step.ASK_MEDIA:
-            if msg.text and msg.text.strip().lower() == "skip":
-                s.step = Step.ASK_ADD_BUTTON
-                return await safe_reply(update, "Tambah <b>button</b>?", reply_markup=yesno_keyboard(), parse_mode=ParseMode.HTML)
-            if msg.photo:
-                s.draft.photo_file_id = msg.photo[-1].file_id
-                s.draft.video_file_id = None
-                s.draft.animation_file_id = None
-            elif msg.video:
-                s.draft.video_file_id = msg.video.file_id
-                s.draft.photo_file_id = None
-                s.draft.animation_file_id = None
-            elif msg.animation:
-                s.draft.animation_file_id = msg.animation.file_id
-                s.draft.photo_file_id = None
-                s.draft.video_file_id = None
-            else:
-                return await safe_reply(update, "Format tidak dikenali. Kirim foto/GIF/video atau <b>skip</b>.", parse_mode=ParseMode.HTML)
-            s.step = Step.ASK_ADD_BUTTON
-            return await safe_reply(update, "Tambah <b>button</b>?", reply_markup=yesno_keyboard(), parse_mode=ParseMode.HTML)
-
-        if s.step == Step.ASK_ADD_BUTTON and msg.text:
-            txt = msg.text.strip().lower()
-            if txt in ("ya", "yes", "y"):
-                s.step = Step.ASK_BUTTON_TEXT
-                return await safe_reply(update, "Kirim <b>teks button</b> (contoh: Kunjungi Situs)", parse_mode=ParseMode.HTML)
-            if txt in ("tidak", "no", "n"):
-                s.step = Step.PREVIEW
-                return await send_preview_to_chat(context, update.effective_chat.id, s.draft)
-
-        if s.step == Step.ASK_BUTTON_TEXT:
-            if not msg.text:
-                return await safe_reply(update, "Kirim teks button (misal: Kunjungi Situs).")
-            s.temp_button_text = msg.text.strip()
-            s.step = Step.ASK_BUTTON_URL
-            return await safe_reply(update, "Kirim URL button (harus diawali http/https).")
-
-        if s.step == Step.ASK_BUTTON_URL:
-            if not msg.text or not msg.text.strip().lower().startswith(("http://", "https://")):
-                return await safe_reply(update, "URL tidak valid. Contoh: https://example.com")
-            s.draft.buttons.append(ButtonDef(text=s.temp_button_text, url=msg.text.strip()))
-            s.temp_button_text = None
-            s.step = Step.ASK_ADD_BUTTON
-            return await safe_reply(update, "Tambah button lagi?", reply_markup=yesno_keyboard())
+        s = ensure_session(context)
+        handler = _STEP_HANDLERS.get(s.step)
+        if handler and await handler(update, context, s, pool) is not False:
+            return
 
     # PUBLIC: jika bukan command → balas default
     if msg and msg.text and msg.text.strip().startswith("/"):
@@ -953,255 +1623,381 @@ async def handle_message(update:Update, context:ContextTypes.DEFAULT_TYPE):
     await send_default_reply(update, context)
 
 # ---------------- Callback ----------------
-async def cb_handler(update:Update, context:ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    pool = get_pool(context)
-    if not pool:
-        return await query.edit_message_text("⚠️ Bot belum siap (DB belum terhubung).")
+# Setiap callback_data "<key>[:<arg>]" dipetakan lewat _CB_TABLE ke handler-nya.
+async def _cb_set_welcome(update:Update, context:ContextTypes.DEFAULT_TYPE, arg:str, s:Session, pool):
+    s.step = Step.SET_WELCOME
+    return await update.callback_query.edit_message_text(
+        "Kirim <b>teks sambutan baru</b> untuk /start (Markdown didukung).",
+        parse_mode=ParseMode.HTML)
+
+async def _cb_set_default(update:Update, context:ContextTypes.DEFAULT_TYPE, arg:str, s:Session, pool):
+    s.step = Step.SET_DEFAULT
+    return await update.callback_query.edit_message_text(
+        "Kirim <b>teks default</b> (Markdown didukung).",
+        parse_mode=ParseMode.HTML)
+
+async def _cb_toggle_start_btn(update:Update, context:ContextTypes.DEFAULT_TYPE, arg:str, s:Session, pool):
+    start_on, default_on = await toggle_button_setting(pool, "start_buttons_on")
+    return await update.callback_query.edit_message_text(
+        "<b>Panel Pengaturan</b>",
+        parse_mode=ParseMode.HTML,
+        reply_markup=_settings_menu_markup(start_on, default_on)
+    )
 
-    uid = query.from_user.id
-    s = ensure_session(uid)
-    data = query.data
-    log.info("Callback data=%s step=%s uid=%s", data, s.step, uid)
-
-    isadm = await is_admin(pool, uid)
-
-    # Settings panel actions
-    if data == "set_welcome":
-        if not isadm:
-            return await query.answer("Khusus admin.", show_alert=True)
-        s.step = Step.SET_WELCOME
-        return await query.edit_message_text("Kirim <b>teks sambutan baru</b> untuk /start (Markdown didukung).",
-                                             parse_mode=ParseMode.HTML)
-
-    if data == "set_default":
-        if not isadm:
-            return await query.answer("Khusus admin.", show_alert=True)
-        s.step = Step.SET_DEFAULT
-        return await query.edit_message_text("Kirim <b>teks default</b> (Markdown didukung).",
-                                             parse_mode=ParseMode.HTML)
-
-    if data == "toggle_start_btn":
-        if not isadm:
-            return await query.answer("Khusus admin.", show_alert=True)
-        new_state = await _toggle_bool(pool, "start_buttons_on")
-        start_on = new_state
-        default_on = await default_buttons_enabled(pool)
-        return await query.edit_message_text(
-            "<b>Panel Pengaturan</b>",
-            parse_mode=ParseMode.HTML,
-            reply_markup=_settings_menu_markup(start_on, default_on)
-        )
+async def _cb_toggle_default_btn(update:Update, context:ContextTypes.DEFAULT_TYPE, arg:str, s:Session, pool):
+    start_on, default_on = await toggle_button_setting(pool, "default_buttons_on")
+    return await update.callback_query.edit_message_text(
+        "<b>Panel Pengaturan</b>",
+        parse_mode=ParseMode.HTML,
+        reply_markup=_settings_menu_markup(start_on, default_on)
+    )
 
-    if data == "toggle_default_btn":
-        if not isadm:
-            return await query.answer("Khusus admin.", show_alert=True)
-        new_state = await _toggle_bool(pool, "default_buttons_on")
-        start_on = await start_buttons_enabled(pool)
-        default_on = new_state
-        return await query.edit_message_text(
-            "<b>Panel Pengaturan</b>",
-            parse_mode=ParseMode.HTML,
-            reply_markup=_settings_menu_markup(start_on, default_on)
-        )
+# Link promo actions
+async def _cb_open_link_admin(update:Update, context:ContextTypes.DEFAULT_TYPE, arg:str, s:Session, pool):
+    _, kb_admin = await link_keyboards(context, pool)
+    return await update.callback_query.edit_message_text(
+        "🔗 <b>Link Promo</b>\nAdmin dapat menambah/hapus link dari tombol di bawah.\n(Catatan: tidak mempengaruhi tombol /start & Default)",
+        reply_markup=kb_admin,
+        parse_mode=ParseMode.HTML
+    )
 
-    if data == "open_link_admin":
-        if not isadm:
-            return await query.answer("Khusus admin.", show_alert=True)
-        rows = await list_links(pool)
-        return await query.edit_message_text(
-            "🔗 <b>Link Promo</b>\nAdmin dapat menambah/hapus link dari tombol di bawah.\n(Catatan: tidak mempengaruhi tombol /start & Default)",
-            reply_markup=_link_keyboard_admin(rows),
-            parse_mode=ParseMode.HTML
-        )
+async def _cb_link_add(update:Update, context:ContextTypes.DEFAULT_TYPE, arg:str, s:Session, pool):
+    s.step = Step.ADD_LINK_TITLE
+    return await update.callback_query.edit_message_text("Kirim <b>judul link</b> promo:", parse_mode=ParseMode.HTML)
 
-    # Link promo actions
-    if data == "link_add":
-        if not isadm:
-            return await query.answer("Khusus admin.", show_alert=True)
-        s.step = Step.ADD_LINK_TITLE
-        return await query.edit_message_text("Kirim <b>judul link</b> promo:", parse_mode=ParseMode.HTML)
+async def _cb_link_del(update:Update, context:ContextTypes.DEFAULT_TYPE, arg:str, s:Session, pool):
+    query = update.callback_query
+    try:
+        link_id = int(arg)
+    except:
+        return await query.answer("ID tidak valid.", show_alert=True)
+    ok = await delete_link(pool, link_id)
+    await refresh_links(context.application.bot_data, pool)
+    _, kb_admin = context.application.bot_data["links_kb"]
+    return await query.edit_message_text(
+        "🔗 <b>Link Promo</b>\n" + ("✅ Link dihapus." if ok else "❌ Gagal menghapus link."),
+        reply_markup=kb_admin,
+        parse_mode=ParseMode.HTML
+    )
 
-    if data.startswith("link_del:"):
-        if not isadm:
-            return await query.answer("Khusus admin.", show_alert=True)
-        try:
-            link_id = int(data.split(":",1)[1])
-        except:
-            return await query.answer("ID tidak valid.", show_alert=True)
-        ok = await delete_link(pool, link_id)
-        rows = await list_links(pool)
-        if ok:
-            return await query.edit_message_text(
-                "🔗 <b>Link Promo</b>\n✅ Link dihapus.",
-                reply_markup=_link_keyboard_admin(rows),
-                parse_mode=ParseMode.HTML
-            )
-        else:
-            return await query.edit_message_text(
-                "🔗 <b>Link Promo</b>\n❌ Gagal menghapus link.",
-                reply_markup=_link_keyboard_admin(rows),
-                parse_mode=ParseMode.HTML
-            )
+# START buttons admin
+async def _cb_open_start_btn_admin(update:Update, context:ContextTypes.DEFAULT_TYPE, arg:str, s:Session, pool):
+    rows = await list_start_buttons(pool)
+    return await update.callback_query.edit_message_text(
+        "⚙️ <b>Kelola Tombol /start</b>",
+        reply_markup=_start_buttons_admin(rows),
+        parse_mode=ParseMode.HTML
+    )
 
-    # START buttons admin
-    if data == "open_start_btn_admin":
-        if not isadm:
-            return await query.answer("Khusus admin.", show_alert=True)
-        rows = await list_start_buttons(pool)
-        return await query.edit_message_text(
-            "⚙️ <b>Kelola Tombol /start</b>",
-            reply_markup=_start_buttons_admin(rows),
-            parse_mode=ParseMode.HTML
-        )
+async def _cb_sb_add(update:Update, context:ContextTypes.DEFAULT_TYPE, arg:str, s:Session, pool):
+    s.step = Step.ADD_SB_TEXT
+    return await update.callback_query.edit_message_text("Kirim <b>teks tombol</b> /start:", parse_mode=ParseMode.HTML)
 
-    if data == "sb_add":
-        if not isadm:
-            return await query.answer("Khusus admin.", show_alert=True)
-        s.step = Step.ADD_SB_TEXT
-        return await query.edit_message_text("Kirim <b>teks tombol</b> /start:", parse_mode=ParseMode.HTML)
+async def _cb_sb_del(update:Update, context:ContextTypes.DEFAULT_TYPE, arg:str, s:Session, pool):
+    query = update.callback_query
+    try:
+        bid = int(arg)
+    except:
+        return await query.answer("ID tidak valid.", show_alert=True)
+    ok = await delete_start_button(pool, bid)
+    rows = await list_start_buttons(pool)
+    return await query.edit_message_text(
+        "⚙️ <b>Kelola Tombol /start</b>\n" + ("✅ Dihapus." if ok else "❌ Gagal menghapus."),
+        reply_markup=_start_buttons_admin(rows),
+        parse_mode=ParseMode.HTML
+    )
 
-    if data.startswith("sb_del:"):
-        if not isadm:
-            return await query.answer("Khusus admin.", show_alert=True)
-        try:
-            bid = int(data.split(":",1)[1])
-        except:
-            return await query.answer("ID tidak valid.", show_alert=True)
-        ok = await delete_start_button(pool, bid)
-        rows = await list_start_buttons(pool)
-        if ok:
-            return await query.edit_message_text(
-                "⚙️ <b>Kelola Tombol /start</b>\n✅ Dihapus.",
-                reply_markup=_start_buttons_admin(rows),
-                parse_mode=ParseMode.HTML
-            )
-        else:
-            return await query.edit_message_text(
-                "⚙️ <b>Kelola Tombol /start</b>\n❌ Gagal menghapus.",
-                reply_markup=_start_buttons_admin(rows),
-                parse_mode=ParseMode.HTML
-            )
+# DEFAULT buttons admin
+async def _cb_open_default_btn_admin(update:Update, context:ContextTypes.DEFAULT_TYPE, arg:str, s:Session, pool):
+    rows = await list_default_buttons(pool)
+    return await update.callback_query.edit_message_text(
+        "⚙️ <b>Kelola Tombol Pesan Default</b>",
+        reply_markup=_default_buttons_admin(rows),
+        parse_mode=ParseMode.HTML
+    )
 
-    # DEFAULT buttons admin
-    if data == "open_default_btn_admin":
-        if not isadm:
-            return await query.answer("Khusus admin.", show_alert=True)
-        rows = await list_default_buttons(pool)
-        return await query.edit_message_text(
-            "⚙️ <b>Kelola Tombol Pesan Default</b>",
-            reply_markup=_default_buttons_admin(rows),
-            parse_mode=ParseMode.HTML
-        )
+async def _cb_db_add(update:Update, context:ContextTypes.DEFAULT_TYPE, arg:str, s:Session, pool):
+    s.step = Step.ADD_DB_TEXT
+    return await update.callback_query.edit_message_text("Kirim <b>teks tombol</b> Default:", parse_mode=ParseMode.HTML)
 
-    if data == "db_add":
-        if not isadm:
-            return await query.answer("Khusus admin.", show_alert=True)
-        s.step = Step.ADD_DB_TEXT
-        return await query.edit_message_text("Kirim <b>teks tombol</b> Default:", parse_mode=ParseMode.HTML)
+async def _cb_db_del(update:Update, context:ContextTypes.DEFAULT_TYPE, arg:str, s:Session, pool):
+    query = update.callback_query
+    try:
+        bid = int(arg)
+    except:
+        return await query.answer("ID tidak valid.", show_alert=True)
+    ok = await delete_default_button(pool, bid)
+    rows = await list_default_buttons(pool)
+    return await query.edit_message_text(
+        "⚙️ <b>Kelola Tombol Pesan Default</b>\n" + ("✅ Dihapus." if ok else "❌ Gagal menghapus."),
+        reply_markup=_default_buttons_admin(rows),
+        parse_mode=ParseMode.HTML
+    )
 
-    if data.startswith("db_del:"):
-        if not isadm:
-            return await query.answer("Khusus admin.", show_alert=True)
-        try:
-            bid = int(data.split(":",1)[1])
-        except:
-            return await query.answer("ID tidak valid.", show_alert=True)
-        ok = await delete_default_button(pool, bid)
-        rows = await list_default_buttons(pool)
-        if ok:
-            return await query.edit_message_text(
-                "⚙️ <b>Kelola Tombol Pesan Default</b>\n✅ Dihapus.",
-                reply_markup=_default_buttons_admin(rows),
-                parse_mode=ParseMode.HTML
-            )
-        else:
-            return await query.edit_message_text(
-                "⚙️ <b>Kelola Tombol Pesan Default</b>\n❌ Gagal menghapus.",
-                reply_markup=_default_buttons_admin(rows),
-                parse_mode=ParseMode.HTML
-            )
+# Broadcast preview actions (hanya berlaku di step tertentu)
+async def _cb_preview_send(update:Update, context:ContextTypes.DEFAULT_TYPE, arg:str, s:Session, pool):
+    query = update.callback_query
+    await start_broadcast(context.application, s.draft, query.message.chat_id)
+    s.step = Step.IDLE
+    s.draft = BroadcastDraft()
+    await query.edit_message_text("Mulai broadcast… Rekap dikirim ke chat ini setelah selesai.")
 
-    # Broadcast preview actions
-    if s.step == Step.PREVIEW:
-        if data == "preview_send":
-            await query.edit_message_text("Mulai broadcast…")
-            await do_broadcast(context, s.draft, query)
-            s.step = Step.IDLE
-            s.draft = BroadcastDraft()
-            return
-        elif data == "preview_restart":
-            s.step = Step.ASK_TEXT
-            s.draft = BroadcastDraft()
-            return await query.edit_message_text("Ulangi. Kirim <b>teks</b> untuk broadcast.", parse_mode=ParseMode.HTML)
-        elif data == "preview_cancel":
-            s.step = Step.IDLE
-            s.draft = BroadcastDraft()
-            return await query.edit_message_text("Broadcast dibatalkan.")
-
-    if s.step == Step.ASK_ADD_BUTTON:
-        if data == "btn_yes":
-            s.step = Step.ASK_BUTTON_TEXT
-            return await query.edit_message_text("Kirim <b>teks button</b> (contoh: Kunjungi Situs)", parse_mode=ParseMode.HTML)
-        elif data == "btn_no":
-            s.step = Step.PREVIEW
-            return await send_preview_to_chat(context, query.message.chat_id, s.draft)
-
-async def do_broadcast(context:ContextTypes.DEFAULT_TYPE, draft:BroadcastDraft, query):
+async def _cb_preview_restart(update:Update, context:ContextTypes.DEFAULT_TYPE, arg:str, s:Session, pool):
+    s.step = Step.ASK_TEXT
+    s.draft = BroadcastDraft(active_only=s.draft.active_only)
+    return await update.callback_query.edit_message_text("Ulangi. Kirim <b>teks</b> untuk broadcast.", parse_mode=ParseMode.HTML)
+
+async def _cb_preview_cancel(update:Update, context:ContextTypes.DEFAULT_TYPE, arg:str, s:Session, pool):
+    s.step = Step.IDLE
+    s.draft = BroadcastDraft()
+    return await update.callback_query.edit_message_text("Broadcast dibatalkan.")
+
+async def _cb_btn_yes(update:Update, context:ContextTypes.DEFAULT_TYPE, arg:str, s:Session, pool):
+    s.step = Step.ASK_BUTTON_TEXT
+    return await update.callback_query.edit_message_text("Kirim <b>teks button</b> (contoh: Kunjungi Situs)", parse_mode=ParseMode.HTML)
+
+async def _cb_btn_no(update:Update, context:ContextTypes.DEFAULT_TYPE, arg:str, s:Session, pool):
+    s.step = Step.PREVIEW
+    return await send_preview_to_chat(context, update.callback_query.message.chat_id, s.draft)
+
+# key -> handler (admin sudah dicek sekali di cb_handler)
+_CB_TABLE = {
+    "set_welcome": _cb_set_welcome,
+    "set_default": _cb_set_default,
+    "toggle_start_btn": _cb_toggle_start_btn,
+    "toggle_default_btn": _cb_toggle_default_btn,
+    "open_link_admin": _cb_open_link_admin,
+    "link_add": _cb_link_add,
+    "link_del": _cb_link_del,
+    "open_start_btn_admin": _cb_open_start_btn_admin,
+    "sb_add": _cb_sb_add,
+    "sb_del": _cb_sb_del,
+    "open_default_btn_admin": _cb_open_default_btn_admin,
+    "db_add": _cb_db_add,
+    "db_del": _cb_db_del,
+}
+
+# (step, key) -> handler: tombol flow broadcast hanya berlaku di step-nya; di step lain diabaikan.
+# Step hanya bisa dicapai lewat command admin, jadi tidak perlu cek admin lagi.
+# Keyboard memakai token 1 huruf; nama panjang tetap diterima untuk tombol lama di riwayat chat.
+_CB_STEP_TABLE = {}
+for _step, _keys, _fn in (
+    (Step.PREVIEW, ("S", "preview_send"), _cb_preview_send),
+    (Step.PREVIEW, ("R", "preview_restart"), _cb_preview_restart),
+    (Step.PREVIEW, ("C", "preview_cancel"), _cb_preview_cancel),
+    (Step.ASK_ADD_BUTTON, ("y", "btn_yes"), _cb_btn_yes),
+    (Step.ASK_ADD_BUTTON, ("n", "btn_no"), _cb_btn_no),
+):
+    for _key in _keys:
+        _CB_STEP_TABLE[(_step, _key)] = _fn
+
+@serialized_per_user("⏳ Masih diproses…")
+async def cb_handler(update:Update, context:ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    uid = query.from_user.id
+    # semua callback (menu setting & flow broadcast) khusus admin; user biasa tidak dibuatkan session
+    if not is_admin_sync(context.application.bot_data, uid):
+        return await query.answer("Khusus admin.", show_alert=True)
+    await query.answer()
     pool = get_pool(context)
     if not pool:
-        return await query.message.reply_text("⚠️ DB tidak siap; broadcast dibatalkan.")
-
-    targets = await get_all_user_ids(pool)
-    total_targets = len(targets)
-
-    sent = 0
-    failed = 0
-    blocked_count = 0
-    deleted_count = 0
-
-    kb = InlineKeyboardMarkup([[InlineKeyboardButton(b.text, url=b.url)] for b in draft.buttons]) if draft.buttons else InlineKeyboardMarkup([])
-
-    for chat_id in targets:
-        try:
-            if draft.photo_file_id:
-                await context.bot.send_photo(chat_id, draft.photo_file_id, caption=draft.text, parse_mode=ParseMode.HTML, reply_markup=kb)
-            elif draft.video_file_id:
-                await context.bot.send_video(chat_id, draft.video_file_id, caption=draft.text, parse_mode=ParseMode.HTML, reply_markup=kb)
-            elif draft.animation_file_id:
-                await context.bot.send_animation(chat_id, draft.animation_file_id, caption=draft.text, parse_mode=ParseMode.HTML, reply_markup=kb)
-            else:
-                await context.bot.send_message(chat_id, draft.text, parse_mode=ParseMode.HTML, reply_markup=kb)
+        return await query.edit_message_text("⚠️ Bot belum siap (DB belum terhubung).")
 
-            sent += 1
-            await asyncio.sleep(0.05)
+    s = ensure_session(context)
+    data = query.data
+    log.info("Callback data=%s step=%s uid=%s", data, s.step.name, uid)
+
+    key, _, arg = data.partition(":")
+    step_handler = _CB_STEP_TABLE.get((s.step, key))
+    if step_handler:
+        return await step_handler(update, context, arg, s, pool)
+    handler = _CB_TABLE.get(key)
+    if not handler:
+        return
+    return await handler(update, context, arg, s, pool)
+
+async def start_broadcast(app, draft:BroadcastDraft, report_chat_id:int) -> int:
+    # Simpan job dulu (sumber kebenaran progres), lalu jalankan di background
+    pool = app.bot_data["pool"]
+    job_id = await create_broadcast_job(pool, draft_to_json(draft), report_chat_id)
+    _spawn_broadcast(app, job_id)
+    return job_id
+
+def _spawn_broadcast(app, job_id:int) -> None:
+    tasks = app.bot_data.setdefault("broadcast_tasks", {})  # job_id -> task
+    if job_id in tasks:
+        return
+    task = tasks[job_id] = asyncio.create_task(run_broadcast_job(app, job_id))
+
+    def _done(t:asyncio.Task):
+        tasks.pop(job_id, None)
+        if not t.cancelled() and t.exception():
+            log.error("Broadcast job %s crashed", job_id, exc_info=t.exception())
+    task.add_done_callback(_done)
+
+async def run_broadcast_job(app, job_id:int):
+    pool = app.bot_data["pool"]
+    bot = app.bot
+    job = await get_broadcast_job(pool, job_id)
+    draft = draft_from_json(job["draft"])
+    if job["next_offset"] != MIN_USER_ID:
+        log.info("Resuming broadcast job %s from user_id > %s", job_id, job["next_offset"])
+
+    kb = draft_keyboard(draft)
+
+    # Draft tidak berubah selama broadcast: ikat method & argumennya sekali saja (partial),
+    # sehingga tiap kiriman cukup send(chat_id). RetryAfter ditangani _send_one sendiri:
+    # AIORateLimiter jangan retry agar worker tidak tertahan dua kali.
+    no_retry = {"max_retries": 0}
+    # tanpa pesan sumber (job lama / preview sudah dihapus): kirim ulang isi draft, sama dengan preview
+    method, kwargs = draft.send_spec(kb)
+    send_draft = partial(getattr(bot, method), rate_limit_args=no_retry, **kwargs)
+    if draft.album:
+        # album: satu sendMediaGroup per user (bukan satu pesan per item); tanpa reply_markup
+        send = partial(bot.send_media_group, media=album_media(draft), rate_limit_args=no_retry)
+    elif draft.source_message_id:
+        # copy pesan preview -> request kecil, Telegram tidak memproses ulang file/teks & entity
+        send = partial(bot.copy_message, from_chat_id=draft.source_chat_id,
+                       message_id=draft.source_message_id, reply_markup=kb, rate_limit_args=no_retry)
+    else:
+        send = send_draft
+
+    # Kirim paralel: BROADCAST_CONCURRENCY worker mengambil user_id dari antrean berbatas
+    # yang diisi langsung dari COPY; limiter menjaga laju global di bawah batas
+    # Telegram (~30 pesan/detik) tanpa sleep per pesan. BROADCAST_RATE sengaja di bawah
+    # batas AIORateLimiter global supaya /start & callback tidak antre di belakang broadcast.
+    limiter = AsyncLimiter(BROADCAST_RATE, 1.0)
+    # album = len(album) pesan di sisi Telegram -> ambil token sebanyak itu per user
+    weight = len(draft.album) if draft.album else 1
+    queue: asyncio.Queue = asyncio.Queue(maxsize=BROADCAST_QUEUE_SIZE)
+    results: Counter = Counter(sent=job["sent"], blocked=job["blocked"],
+                               deleted=job["deleted"], failed=job["failed"])
+
+    # Log per user disampel: satu baris untuk kejadian pertama lalu tiap LOG_SAMPLE per jenis,
+    # supaya broadcast besar tidak membanjiri log (rekap lengkap tetap dikirim di akhir).
+    log_counts: Counter = Counter()
+    # user yang memblokir/terhapus: dihapus sekaligus per chunk, bukan satu DELETE per kiriman gagal
+    dead: List[int] = []
+
+    def _note(kind:str, chat_id:int, err:Exception, level:int=logging.WARNING) -> str:
+        log_counts[kind] += 1
+        n = log_counts[kind]
+        if (n == 1 or n % LOG_SAMPLE == 0) and log.isEnabledFor(level):
+            log.log(level, "Broadcast job %s: %d %s so far, last: %s -> %s", job_id, n, kind, chat_id, err)
+        return kind
+
+    # Flood control berlaku untuk bot, bukan per chat: satu RetryAfter menahan SEMUA worker
+    # sampai flood_until, supaya worker lain tidak terus memicu 429 selama jendela tunggu.
+    loop = asyncio.get_running_loop()
+    flood_until = 0.0
+
+    async def _send_one(chat_id:int) -> str:
+        nonlocal flood_until, send
+        attempt = 0
+        while True:
+            wait = flood_until - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                await limiter.acquire(weight)
+                await send(chat_id=chat_id)
+                return "sent"
+            except RetryAfter as e:
+                # kirim ulang setelah jendela flood (tidak dihitung attempt)
+                flood_until = max(flood_until, loop.time() + e.retry_after + 0.5)
+                _note("rate-limited", chat_id, e)
+            except Forbidden as e:
+                # - "Forbidden: bot was blocked by the user"
+                # - "Forbidden: user is deactivated"
+                # Keduanya permanen -> hapus dari DB agar broadcast berikutnya lebih kecil
+                dead.append(chat_id)
+                if "blocked by the user" in str(e).lower():
+                    return _note("blocked", chat_id, e, logging.INFO)
+                return _note("deleted", chat_id, e, logging.INFO)
+            except BadRequest as e:
+                # - "Bad Request: chat not found"
+                # - "Bad Request: PEER_ID_INVALID"
+                msg = str(e).lower()
+                if "message to copy not found" in msg:
+                    # preview sumber dihapus admin: sisa job memakai isi draft, user ini dikirim ulang
+                    if send is not send_draft:
+                        log.warning("Broadcast job %s: source message gone, sending draft content", job_id)
+                        send = send_draft
+                    continue
+                if ("chat not found" in msg) or ("peer_id_invalid" in msg):
+                    dead.append(chat_id)
+                    return _note("deleted", chat_id, e, logging.INFO)
+                return _note("failed", chat_id, e)
+            except NetworkError as e:
+                # termasuk TimedOut: coba lagi dengan backoff eksponensial
+                attempt += 1
+                if attempt >= BROADCAST_ATTEMPTS:
+                    return _note("failed", chat_id, e)
+                await asyncio.sleep(2 ** (attempt - 1))
+            except TelegramError as e:
+                return _note("failed", chat_id, e)
+
+    # error di luar TelegramError (mis. HTTP client sudah ditutup) bukan kegagalan user:
+    # chunk-nya tidak boleh di-checkpoint, job berhenti dan dilanjutkan lagi nanti
+    crashed: List[Exception] = []
+
+    async def _worker():
+        while True:
+            chat_id = await queue.get()
+            try:
+                if not crashed:
+                    results[await _send_one(chat_id)] += 1
+            except Exception as e:
+                crashed.append(e)
+            finally:
+                queue.task_done()
+
+    # Per chunk BROADCAST_CHUNK user: isi antrean, tunggu semua terkirim, lalu simpan
+    # checkpoint. Crash di tengah chunk hanya mengulang chunk itu (at-least-once).
+    total_targets = job["total"]
+    offset = job["next_offset"]
+    last_id = offset
+
+    async def _enqueue(uid:int):
+        nonlocal last_id
+        last_id = uid
+        await queue.put(uid)
+
+    workers = [asyncio.create_task(_worker()) for _ in range(BROADCAST_CONCURRENCY)]
+    try:
+        while True:
+            n = await stream_user_ids(pool, _enqueue, draft.active_only, after=offset)
+            await queue.join()
+            if dead:
+                await _delete_users(pool, dead)
+                dead.clear()
+            if crashed:
+                raise crashed[0]
+            if not n:
+                break
+            total_targets += n
+            offset = last_id
+            if not await save_broadcast_progress(pool, job_id, offset, total_targets, results):
+                log.warning("Broadcast job %s claimed by another instance, stopping", job_id)
+                return
+    finally:
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    if not await save_broadcast_progress(pool, job_id, offset, total_targets, results, done=True):
+        return
 
-        except Exception as e:
-            msg = str(e).lower()
-            # Klasifikasi error yang umum dari Telegram API
-            # Contoh pesan:
-            # - "Forbidden: bot was blocked by the user"
-            # - "Forbidden: user is deactivated"
-            # - "Bad Request: chat not found"
-            # - "Bad Request: PEER_ID_INVALID"
-            if "blocked by the user" in msg:
-                blocked_count += 1
-                log.info("User %s blocked the bot.", chat_id)
-            elif ("user is deactivated" in msg) or ("chat not found" in msg) or ("peer_id_invalid" in msg):
-                deleted_count += 1
-                log.info("User %s deactivated/invalid. Removing from DB.", chat_id)
-                await _delete_user(pool, chat_id)
-            else:
-                failed += 1
-                log.warning("Broadcast fail %s: %s", chat_id, e)
-            await asyncio.sleep(0.3)
+    sent = results["sent"]
+    blocked_count = results["blocked"]
+    deleted_count = results["deleted"]
+    failed = results["failed"]
 
     # Hitung total pengguna setelah pembersihan akun terhapus
     total_users_after = await count_users(pool)
 
     summary = (
-        "📣 <b>Rekap Broadcast</b>\n"
+        "📣 <b>Rekap Broadcast</b>"
+        + (f" (user aktif {ACTIVE_DAYS} hari)" if draft.active_only else "") + "\n"
         f"• Total target: <b>{total_targets}</b>\n"
         f"• Berhasil terkirim: <b>{sent}</b>\n"
         f"• Pengguna memblokir bot: <b>{blocked_count}</b>\n"
@@ -1210,7 +2006,10 @@ async def do_broadcast(context:ContextTypes.DEFAULT_TYPE, draft:BroadcastDraft,
         f"• Total pengguna saat ini: <b>{total_users_after}</b>"
     )
 
-    await query.message.reply_text(summary, parse_mode=ParseMode.HTML)
+    try:
+        await bot.send_message(job["report_chat_id"], summary, parse_mode=ParseMode.HTML)
+    except TelegramError as e:
+        log.warning("Broadcast job %s summary not delivered: %s", job_id, e)
 
 
 # ---------------- Health & Error ----------------
@@ -1229,35 +2028,121 @@ async def on_error(update: object, context):
 
 # ---------------- Lifecycle ----------------
 async def post_init(app):
-    pool = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=5)
+    app.bot_data["health_server"] = await start_health_server(lambda: "pool" in app.bot_data)
+    # query bot ini kecil-kecil; JIT hanya menambah latensi planning.
+    # PgBouncer menolak startup parameter selain yang dikenalnya (jit) -> hanya application_name.
+    server_settings = {"application_name": "nagabola-bot"}
+    if not DB_PGBOUNCER:
+        server_settings["jit"] = "off"
+    pool = await asyncpg.create_pool(
+        DATABASE_URL,
+        min_size=DB_POOL_MIN, max_size=DB_POOL_MAX,
+        max_inactive_connection_lifetime=600,
+        statement_cache_size=0 if DB_PGBOUNCER else 1024,
+        # query macet tidak boleh menahan koneksi pool (dan handler) tanpa batas
+        command_timeout=10,
+        server_settings=server_settings,
+    )
     await init_db(pool)
     app.bot_data["pool"] = pool
+    app.bot_data["track_queue"] = asyncio.Queue()
+    app.bot_data["track_task"] = asyncio.create_task(track_writer(pool, app.bot_data["track_queue"]))
+    app.bot_data["session_gc_task"] = asyncio.create_task(gc_sessions(app))
+    app.bot_data["session_flush_task"] = asyncio.create_task(flush_sessions(app.persistence))
     await app.bot.delete_webhook(drop_pending_updates=False)
     me = await app.bot.get_me()
     owner_id = await get_owner_id(pool)
     await del_admin(pool, owner_id)  # pastikan owner tidak tercatat sebagai admin
+    await refresh_admins(app.bot_data, pool)  # juga mengisi cache bot_data["owner_id"]
+    await refresh_welcome_text(app.bot_data, pool)
+    await refresh_links(app.bot_data, pool)
+    await start_cache_listener(app.bot_data, pool)  # mengisi bot_data["cache_listener"]
     log.info("Authorized as @%s (%s). OWNER=%s", me.username, me.id, owner_id)
+    # lanjutkan broadcast yang terputus oleh crash/redeploy (juga milik instance lain yang mati)
+    app.bot_data["broadcast_resume_task"] = asyncio.create_task(resume_broadcasts(app))
+
+async def resume_broadcasts(app, interval:float=BROADCAST_RESUME_INTERVAL):
+    pool = app.bot_data["pool"]
+    while True:
+        try:
+            running = list(app.bot_data.get("broadcast_tasks", {}))
+            for job_id in await claim_broadcast_jobs(pool, running):
+                _spawn_broadcast(app, job_id)
+        except (asyncpg.PostgresError, OSError, asyncio.TimeoutError) as e:
+            log.warning("Claiming broadcast jobs failed: %s", e)
+        await asyncio.sleep(interval)
+
+async def post_stop(app):
+    # dijalankan sebelum Application.shutdown() menutup HTTP client bot: broadcast yang
+    # dibatalkan di sini berhenti bersih, tanpa kiriman yang gagal karena client sudah tertutup.
+    # Progres sudah di-checkpoint per chunk; sisanya dilanjutkan saat start berikutnya.
+    resume_task = app.bot_data.get("broadcast_resume_task")
+    if resume_task:
+        resume_task.cancel()
+    tasks = list(app.bot_data.get("broadcast_tasks", {}).values())
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    pool = app.bot_data.get("pool")
+    if pool:
+        try:
+            await release_broadcast_jobs(pool)
+        except (asyncpg.PostgresError, OSError, asyncio.TimeoutError) as e:
+            log.warning("Releasing broadcast jobs failed: %s", e)
 
 async def post_shutdown(app):
+    for key in ("session_gc_task", "session_flush_task"):
+        bg_task = app.bot_data.get(key)
+        if bg_task:
+            bg_task.cancel()
+    task = app.bot_data.get("track_task")
+    if task:
+        app.bot_data["track_queue"].put_nowait(None)  # tulis sisa antrean dulu
+        await task
+    listener = app.bot_data.pop("cache_listener", None)
+    if listener:
+        await listener.close()
     pool = app.bot_data.get("pool")
     if pool:
         await pool.close()
         log.info("DB pool closed.")
+    srv = app.bot_data.get("health_server")
+    if srv:
+        srv.close()
+        await srv.wait_closed()
 
 # ---------------- Build App ----------------
 def build_app():
-    req = HTTPXRequest(connect_timeout=15.0, read_timeout=45.0, write_timeout=15.0, pool_timeout=15.0)
+    # HTTP/2: banyak panggilan API (mis. broadcast) berbagi satu koneksi TLS ke api.telegram.org
+    req = HTTPXRequest(connection_pool_size=64, http_version="2",
+                       connect_timeout=10.0, read_timeout=20.0, write_timeout=15.0, pool_timeout=30.0)
+    # long-polling getUpdates tetap di koneksi sendiri agar tidak menahan slot pool di atas
+    updates_req = HTTPXRequest(connect_timeout=15.0, read_timeout=45.0, write_timeout=15.0, pool_timeout=15.0)
     app = (
         ApplicationBuilder()
         .token(BOT_TOKEN)
         .request(req)
+        .get_updates_request(updates_req)
+        # user lain tidak menunggu handler user yang lambat; urutan per user dijaga serialized_per_user
+        .concurrent_updates(CONCURRENT_UPDATES)
+        # hanya user_data (session admin) yang dipersist; bot_data berisi pool/task yang tidak bisa
+        # di-pickle. PTB menyerahkan perubahan tiap update_interval detik, file ditulis flush_sessions.
+        .persistence(SessionPersistence(
+            SESSIONS_FILE,
+            store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+            update_interval=5,
+        ))
+        # satu ember global ~30 pesan/detik untuk semua panggilan API (interaktif + broadcast)
+        .rate_limiter(AIORateLimiter(overall_max_rate=30, overall_time_period=1, max_retries=3))
         .post_init(post_init)
+        .post_stop(post_stop)
         .post_shutdown(post_shutdown)
         .build()
     )
 
-    # Order: debug (-2), track (-1), commands (0), callbacks (0), message flow (1)
-    app.add_handler(TypeHandler(Update, debug_all, block=False), group=-2)
+    # Order: debug (-2, opsional), track (-1), commands (0), callbacks (0), message flow (1)
+    if LOG_UPDATES:
+        app.add_handler(TypeHandler(Update, debug_all, block=False), group=-2)
     app.add_handler(TypeHandler(Update, track, block=False), group=-1)
 
     # PUBLIC commands
@@ -1266,31 +2151,48 @@ def build_app():
     app.add_handler(CommandHandler("help", help_cmd), group=0)
     app.add_handler(CommandHandler("health", health_cmd), group=0)
 
-    # ADMIN/OWNER commands
-    app.add_handler(CommandHandler("ping", ping_cmd), group=0)
-    app.add_handler(CommandHandler("stats", stats_cmd), group=0)
-    app.add_handler(CommandHandler("admins", admins_cmd), group=0)
-
-    # Owner & admin mgmt
-    app.add_handler(CommandHandler(["admin_add","addadmin","add_admin"], admin_add_cmd), group=0)
-    app.add_handler(CommandHandler(["admin_del","deladmin","del_admin","admin_delete"], admin_del_cmd), group=0)
-    app.add_handler(CommandHandler(["owner_show","owner"], owner_show_cmd), group=0)
-    app.add_handler(CommandHandler(["owner_set","set_owner"], owner_set_cmd), group=0)
+    # ADMIN/OWNER commands (ADMIN_FILTER: non-admin tidak pernah masuk handler, jadi handler
+    # tidak memeriksa admin lagi; owner termasuk di ADMIN_FILTER, ensure_owner tetap membedakan owner)
+    admin_commands = (
+        (["ping"], ping_cmd),
+        (["stats"], stats_cmd),
+        (["admins"], admins_cmd),
+        # Owner & admin mgmt
+        (["admin_add", "addadmin", "add_admin"], admin_add_cmd),
+        (["admin_del", "deladmin", "del_admin", "admin_delete"], admin_del_cmd),
+        (["owner_show", "owner"], owner_show_cmd),
+        (["owner_set", "set_owner"], owner_set_cmd),
+        # Broadcast & Setting
+        (["broadcast"], broadcast_cmd),
+        (["broadcast_active"], broadcast_active_cmd),
+        (["setting"], setting_cmd),
+    )
+    for names, fn in admin_commands:
+        app.add_handler(CommandHandler(names, fn, filters=ADMIN_FILTER), group=0)
 
-    # Broadcast & Setting
-    app.add_handler(CommandHandler("broadcast", broadcast_cmd), group=0)
-    app.add_handler(CommandHandler("setting", setting_cmd), group=0)
+    # Non-admin yang memanggil command admin: satu balasan statis, tanpa handler per command
+    app.add_handler(CommandHandler([n for names, _ in admin_commands for n in names], not_admin_cmd), group=0)
 
     # Callback + message flow
     app.add_handler(CallbackQueryHandler(cb_handler), group=0)
-    app.add_handler(MessageHandler(filters.ALL, handle_message), group=1)
+    # hanya pesan baru di chat privat dengan jenis yang dipakai flow (teks & media broadcast);
+    # channel post, edit, service message, dll. ditolak filter tanpa masuk handler.
+    # Command tidak dikecualikan: flow SET_WELCOME/SET_DEFAULT perlu melihatnya untuk menolak/membersihkan.
+    app.add_handler(MessageHandler(
+        filters.UpdateType.MESSAGE & filters.ChatType.PRIVATE
+        & (filters.TEXT | filters.PHOTO | filters.VIDEO | filters.ANIMATION),
+        handle_message), group=1)
 
     app.add_error_handler(on_error)
     return app
 
 # ---------------- Main ----------------
 def main():
-    threading.Thread(target=start_health_server, daemon=True).start()
+    try:
+        import uvloop  # opsional; loop libuv lebih cepat untuk I/O jaringan
+        uvloop.install()
+    except ImportError:
+        pass
     app = build_app()
     app.run_polling(drop_pending_updates=False)
 